@@ -1,3 +1,4 @@
+import argparse
 import logging
 import sys
 import os
@@ -39,6 +40,11 @@ def save_log(filename, query, user_input, api_output):
     with open(filename, 'w', encoding='utf-8') as f:
         json.dump(logs, f, ensure_ascii=False, indent=2)
 
+def parse_args():
+    parser = argparse.ArgumentParser(description="GraphRAG 问答 (对比模式)")
+    parser.add_argument("--profile", action="store_true", help="开启性能分析 (CPU 采样、内存分配、Neo4j PROFILE)，退出时报告写入 reports/")
+    return parser.parse_args()
+
 def main(): 
     print("🤖 欢迎使用 GraphRAG 问答系统 (对比模式)")
     print("输入 'exit' 或 'quit' 退出")
@@ -87,4 +93,13 @@ def main():
             logger.error(f"发生错误: {e}")
 
 if __name__ == "__main__":
-    main()
+    args = parse_args()
+    if args.profile:
+        from core.profiler import Profiler
+        profiler = Profiler().start()
+        try:
+            main()
+        finally:
+            profiler.stop()
+    else:
+        main()
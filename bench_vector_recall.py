@@ -0,0 +1,108 @@
+"""
+向量压缩方案的召回率基准测试 (离线，不需要连接 Neo4j)
+从 storage/ 中的 .f32 向量缓存读取全部文本块向量，随机抽取若干向量作为查询，
+对比全精度暴力检索的 top-k 与以下方案的 recall@k：
+  - reduced-d:        只用前 d 维检索
+  - reduced-d+rescore: 前 d 维召回 k * multiplier 个候选，再用全精度向量重排 (即 vector_storage.mode = reduced)
+  - int8+rescore:      逐向量 int8 标量量化后召回，再用全精度向量重排 (近似 Neo4j 量化索引)
+用法: python bench_vector_recall.py --k 5 --dims 128,256,512 --multiplier 4 --queries 50
+"""
+import argparse
+import glob
+import heapq
+import math
+import os
+import random
+import re
+import sys
+import time
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from config import settings
+from core.embedding import float32_from_bytes, embedding_version, version_slug, legacy_embedding_version
+
+def load_cached_vectors(dim):
+    """读取 storage/ 中当前 embedding 版本的 .f32 向量文件 (按配置的维度切分)"""
+    vectors = []
+    stride = dim * 4
+    version = embedding_version()
+    storage_dir = os.path.join(settings.ROOT_DIR, 'storage')
+    paths = glob.glob(os.path.join(storage_dir, f'*.{version_slug(version)}.f32'))
+    # 旧版缓存的向量文件没有版本后缀 ({文件名}.{md5}.f32)
+    if legacy_embedding_version() == version:
+        paths += [path for path in glob.glob(os.path.join(storage_dir, '*.f32'))
+                  if re.search(r'\.[0-9a-f]{32}\.f32$', path)]
+    for path in paths:
+        with open(path, 'rb') as f:
+            blob = f.read()
+        if len(blob) % stride:
+            print(f"⚠️ 跳过维度不匹配的向量文件: {os.path.basename(path)}")
+            continue
+        for start in range(0, len(blob), stride):
+            vectors.append(normalize(float32_from_bytes(blob[start:start + stride])))
+    return vectors
+
+def normalize(vec):
+    norm = math.sqrt(sum(x * x for x in vec)) or 1.0
+    return [x / norm for x in vec]
+
+def dot(a, b):
+    return sum(x * y for x, y in zip(a, b))
+
+def top_k(query, vectors, k, exclude, score_fn=dot):
+    scored = ((score_fn(query, vec), i) for i, vec in enumerate(vectors) if i != exclude)
+    return [i for _, i in heapq.nlargest(k, scored)]
+
+def quantize_int8(vec):
+    """逐向量按最大绝对值缩放到 [-127, 127]"""
+    scale = max(abs(x) for x in vec) or 1.0
+    return [round(x / scale * 127) for x in vec]
+
+def rescore(query, vectors, candidates, k):
+    return [i for _, i in heapq.nlargest(k, ((dot(query, vectors[i]), i) for i in candidates))]
+
+def main():
+    parser = argparse.ArgumentParser(description="向量压缩方案的 recall@k 基准测试")
+    parser.add_argument("--k", type=int, default=5)
+    parser.add_argument("--dims", default="128,256,512", help="逗号分隔的降维维度")
+    parser.add_argument("--multiplier", type=int, default=settings.VECTOR_CANDIDATE_MULTIPLIER)
+    parser.add_argument("--queries", type=int, default=50, help="抽样查询数")
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    vectors = load_cached_vectors(settings.EMBEDDING_DIM)
+    if len(vectors) <= args.k:
+        print(f"❌ storage/ 中只有 {len(vectors)} 个向量，不足以测试 recall@{args.k}，请先运行 main.py")
+        return
+
+    random.seed(args.seed)
+    query_ids = random.sample(range(len(vectors)), min(args.queries, len(vectors)))
+    k, candidates_k = args.k, args.k * args.multiplier
+    print(f"📊 向量数: {len(vectors)}, 维度: {settings.EMBEDDING_DIM}, 查询数: {len(query_ids)}, k={k}, 候选数={candidates_k}\n")
+
+    exact = {q: top_k(vectors[q], vectors, k, q) for q in query_ids}
+
+    def report(name, retrieve, bytes_per_vector):
+        start = time.perf_counter()
+        hits = sum(len(set(retrieve(q)) & set(exact[q])) for q in query_ids)
+        elapsed = (time.perf_counter() - start) / len(query_ids) * 1000
+        recall = hits / (k * len(query_ids))
+        print(f"{name:<24} recall@{k}: {recall:6.3f}   每向量 {bytes_per_vector:>5} 字节   {elapsed:7.1f} ms/查询")
+
+    report("full (float32)", lambda q: exact[q], settings.EMBEDDING_DIM * 4)
+
+    for dim in [int(d) for d in args.dims.split(",") if d.strip()]:
+        if dim >= settings.EMBEDDING_DIM:
+            continue
+        reduced = [normalize(vec[:dim]) for vec in vectors]
+        report(f"reduced-{dim}", lambda q: top_k(reduced[q], reduced, k, q), dim * 4)
+        report(f"reduced-{dim}+rescore",
+               lambda q: rescore(vectors[q], vectors, top_k(reduced[q], reduced, candidates_k, q), k), dim * 4)
+
+    quantized = [quantize_int8(vec) for vec in vectors]
+    report("int8+rescore",
+           lambda q: rescore(vectors[q], vectors, top_k(quantized[q], quantized, candidates_k, q), k), settings.EMBEDDING_DIM)
+
+if __name__ == "__main__":
+    main()
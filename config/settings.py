@@ -1,57 +1,19 @@
 # 将ymal配置加载成python对象
+# 配置按需加载：首次访问某个配置变量时才读取 YAML / .env (见模块底部的 __getattr__)，
+# 这样不需要配置的命令 (或只需要部分配置的进程) 可以更快启动
 
 import os
 import logging
 import sys
 import io
-from dotenv import load_dotenv
-from utils import load_yaml_config
 
-# 强制设置标准输出为 UTF-8，解决 Windows 下 Emoji 导致的 GBK 编码错误
-if sys.platform == "win32":
-    try:
-        sys.stdout = io.TextIOWrapper(sys.stdout.buffer, encoding='utf-8')
-        sys.stderr = io.TextIOWrapper(sys.stderr.buffer, encoding='utf-8')
-    except AttributeError:
-        # 在某些 IDE (如 pytest 或旧版 Notebook) 中 buffer 可能不可用
-        pass
+logger = logging.getLogger(__name__)
 
 # 项目根目录
 ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__))) 
 
-# 1. 加载环境变量 (读取 .env)
-load_dotenv(os.path.join(ROOT_DIR, '.env'))
-
-# 2. 读取 YAML 配置
 CONFIG_PATH = os.path.join(os.path.dirname(__file__), 'config.yaml')
 
-try:
-    _yaml_conf = load_yaml_config(CONFIG_PATH)
-except Exception as e:
-    print(f"❌ 加载配置文件 {CONFIG_PATH} 失败: {e}")
-    _yaml_conf = {}
-
-# ================= 导出配置变量 =================
-
-# API 相关
-API_KEY = os.getenv("DASHSCOPE_API_KEY")
-if not API_KEY:
-    print("⚠️ 警告: 未找到 DASHSCOPE_API_KEY，请确保 .env 文件存在且已配置。")
-
-# 模型相关
-LLM_SETTINGS = _yaml_conf.get('llm', {})
-MODEL_NAME = LLM_SETTINGS.get('model_name', 'qwen-max')
-BASE_URL = LLM_SETTINGS.get('base_url', '')
-TEMPERATURE = LLM_SETTINGS.get('temperature', 0.1)
-
-# Embedding 相关
-EMBEDDING_SETTINGS = _yaml_conf.get('embedding', {})
-EMBEDDING_MODEL = EMBEDDING_SETTINGS.get('model_name', 'text-embedding-v3')
-EMBEDDING_DIM = EMBEDDING_SETTINGS.get('dimensions', 1024)
-
-# 路径相关
-PATHS = _yaml_conf.get('paths', {})
-
 # 将相对路径转换为绝对路径，确保在任何地方调用都正确
 def get_abs_path(path_str, default_folder=""):
     if not path_str:
@@ -60,27 +22,177 @@ def get_abs_path(path_str, default_folder=""):
         return path_str
     return os.path.join(ROOT_DIR, path_str)
 
-DATA_DIR = get_abs_path(PATHS.get('data_dir', 'data'))
-PROMPT_FILE = get_abs_path(PATHS.get('prompt_file', 'prompt/standardize.md'))
+# ================= 导出配置变量 =================
+
+def _load_env_settings():
+    """加载环境变量 (读取 .env)，导出 API / 数据库凭据"""
+    from dotenv import load_dotenv
+    load_dotenv(os.path.join(ROOT_DIR, '.env'))
 
-# 日志文件存放在 logs 目录下
-log_filename = PATHS.get('log_file', 'app.log')
-LOG_FILE = os.path.join(ROOT_DIR, 'logs', log_filename)
+    # API 相关
+    api_key = os.getenv("DASHSCOPE_API_KEY")
+    if not api_key:
+        logger.warning("⚠️ 警告: 未找到 DASHSCOPE_API_KEY，请确保 .env 文件存在且已配置。")
 
-# 绘图相关
-PLOT_SETTINGS = _yaml_conf.get('plot', {})
+    # Neo4j 数据库配置
+    neo4j_password = os.getenv("DATABASE_KEY")
+    if not neo4j_password:
+        logger.warning("⚠️ 警告: 未找到 DATABASE_KEY，数据库连接可能会失败。")
 
-# Neo4j 数据库配置
-NEO4J_URI = os.getenv("NEO4J_URI")
-NEO4J_USER = os.getenv("NEO4J_USER")
-NEO4J_PASSWORD = os.getenv("DATABASE_KEY")
+    return {
+        "API_KEY": api_key,
+        "NEO4J_URI": os.getenv("NEO4J_URI"),
+        "NEO4J_USER": os.getenv("NEO4J_USER"),
+        "NEO4J_PASSWORD": neo4j_password,
+    }
 
-if not NEO4J_PASSWORD:
-    print("⚠️ 警告: 未找到 DATABASE_KEY，数据库连接可能会失败。")
+def _load_yaml_settings():
+    """读取 YAML 配置，导出模型、路径等配置变量"""
+    from utils import load_yaml_config
+
+    try:
+        yaml_conf = load_yaml_config(CONFIG_PATH) or {}
+    except Exception as e:
+        print(f"❌ 加载配置文件 {CONFIG_PATH} 失败: {e}")
+        yaml_conf = {}
+
+    llm_settings = yaml_conf.get('llm', {})
+    embedding_settings = yaml_conf.get('embedding', {})
+    migration_settings = yaml_conf.get('embedding_migration', {})
+    vector_settings = yaml_conf.get('vector_storage', {})
+    extraction_settings = yaml_conf.get('extraction', {})
+    entity_settings = yaml_conf.get('entity_resolution', {})
+    linking_settings = yaml_conf.get('concept_linking', {})
+    community_settings = yaml_conf.get('community', {})
+    watch_settings = yaml_conf.get('watch', {})
+    graph_settings = yaml_conf.get('graph', {})
+    neo4j_settings = yaml_conf.get('neo4j', {})
+    profile_settings = yaml_conf.get('profile', {})
+    paths = yaml_conf.get('paths', {})
+
+    return {
+        # 模型相关
+        "LLM_SETTINGS": llm_settings,
+        "MODEL_NAME": llm_settings.get('model_name', 'qwen-max'),
+        "BASE_URL": llm_settings.get('base_url', ''),
+        "TEMPERATURE": llm_settings.get('temperature', 0.1),
+
+        # Embedding 相关
+        "EMBEDDING_SETTINGS": embedding_settings,
+        "EMBEDDING_MODEL": embedding_settings.get('model_name', 'text-embedding-v3'),
+        "EMBEDDING_DIM": embedding_settings.get('dimensions', 1024),
+        "EMBEDDING_ENCODING_FORMAT": embedding_settings.get('encoding_format', 'float'),
+
+        # embedding 模型/维度迁移相关
+        "EMBEDDING_MIGRATION_BATCH_SIZE": migration_settings.get('batch_size', 64),
+        "EMBEDDING_MIGRATION_REQUESTS_PER_MINUTE": migration_settings.get('requests_per_minute', 30),
+        "EMBEDDING_MIGRATION_MAX_FAILURES": migration_settings.get('max_consecutive_failures', 5),
+        "EMBEDDING_VERSION_REFRESH_INTERVAL": migration_settings.get('refresh_interval', 60),
+        "EMBEDDING_MIGRATION_LEGACY_MODEL": migration_settings.get('legacy_model'),
+
+        # 向量存储相关
+        "VECTOR_STORAGE_MODE": vector_settings.get('mode', 'full'),
+        "VECTOR_REDUCED_DIM": vector_settings.get('reduced_dim', 256),
+        "VECTOR_QUANTIZATION": vector_settings.get('quantization', False),
+        "VECTOR_CANDIDATE_MULTIPLIER": vector_settings.get('candidate_multiplier', 4),
+
+        # Neo4j 驱动相关 (连接地址和账号在 .env 中)
+        "NEO4J_DATABASE": neo4j_settings.get('database'),
+        "NEO4J_MAX_POOL_SIZE": neo4j_settings.get('max_connection_pool_size', 50),
+        "NEO4J_ACQUISITION_TIMEOUT": neo4j_settings.get('connection_acquisition_timeout', 30),
+        "NEO4J_CONNECTION_TIMEOUT": neo4j_settings.get('connection_timeout', 15),
+        "NEO4J_MAX_RETRY_TIME": neo4j_settings.get('max_transaction_retry_time', 15),
+        "NEO4J_FETCH_SIZE": neo4j_settings.get('fetch_size', 1000),
+
+        # 图谱存储相关
+        "GRAPH_RELATION_SCHEMA": graph_settings.get('relation_schema', 'fixed'),
+
+        # 提取相关
+        "EXTRACTION_SETTINGS": extraction_settings,
+        "EXTRACTION_BATCH_ENABLED": extraction_settings.get('batch_enabled', False),
+        "EXTRACTION_BATCH_TOKEN_BUDGET": extraction_settings.get('batch_token_budget', 6000),
+        "EXTRACTION_BATCH_SMALL_NOTE_TOKENS": extraction_settings.get('batch_small_note_tokens', 800),
+        "EXTRACTION_BATCH_MAX_NOTES": extraction_settings.get('batch_max_notes', 12),
+        "EXTRACTION_MAX_REPAIR_RETRIES": extraction_settings.get('max_repair_retries', 1),
+
+        # 实体消歧相关
+        "ENTITY_RESOLUTION_ENABLED": entity_settings.get('enabled', True),
+        "ENTITY_ALIAS_FILE": get_abs_path(entity_settings.get('alias_file', 'config/aliases.yaml')),
+        "ENTITY_GENERIC_SUFFIXES": entity_settings.get('generic_suffixes', ["容器", "框架"]),
+        "ENTITY_USE_EMBEDDING": entity_settings.get('use_embedding', False),
+        "ENTITY_SIMILARITY_THRESHOLD": entity_settings.get('similarity_threshold', 0.92),
+
+        # 查询时概念链接相关
+        "CONCEPT_LINKING_ENABLED": linking_settings.get('enabled', True),
+        "CONCEPT_LINKING_REFRESH_INTERVAL": linking_settings.get('refresh_interval', 30),
+        "CONCEPT_LINKING_MIN_NAME_LENGTH": linking_settings.get('min_name_length', 2),
+        "CONCEPT_LINKING_CHUNKS_PER_CONCEPT": linking_settings.get('chunks_per_concept', 3),
+
+        # 社区摘要相关
+        "COMMUNITY_ENABLED": community_settings.get('enabled', True),
+        "COMMUNITY_MIN_SIZE": community_settings.get('min_size', 3),
+        "COMMUNITY_MAX_ITERATIONS": community_settings.get('max_iterations', 20),
+        "COMMUNITY_MAX_MEMBERS_IN_PROMPT": community_settings.get('max_members_in_prompt', 40),
+        "COMMUNITY_MAX_CHUNKS_IN_PROMPT": community_settings.get('max_chunks_in_prompt', 8),
+        "COMMUNITY_TOP_K": community_settings.get('top_k', 3),
+        "COMMUNITY_GLOBAL_KEYWORDS": community_settings.get('global_keywords', ["总结", "概括", "整体", "总体", "有哪些", "概览"]),
+
+        # watch 模式相关
+        "WATCH_DEBOUNCE_SECONDS": watch_settings.get('debounce_seconds', 2.0),
+        "WATCH_POLL_INTERVAL": watch_settings.get('poll_interval', 1.0),
+        "WATCH_USE_WATCHDOG": watch_settings.get('use_watchdog', True),
+
+        # --profile 模式相关
+        "PROFILE_OUTPUT_DIR": get_abs_path(profile_settings.get('output_dir', 'reports')),
+        "PROFILE_SAMPLE_INTERVAL_MS": profile_settings.get('sample_interval_ms', 5),
+        "PROFILE_TRACEMALLOC_FRAMES": profile_settings.get('tracemalloc_frames', 10),
+        "PROFILE_TOP_N": profile_settings.get('top_n', 40),
+
+        # 路径相关
+        "PATHS": paths,
+        "DATA_DIR": get_abs_path(paths.get('data_dir', 'data')),
+        "PROMPT_FILE": get_abs_path(paths.get('prompt_file', 'prompt/standardize.md')),
+        # 日志文件存放在 logs 目录下
+        "LOG_FILE": os.path.join(ROOT_DIR, 'logs', paths.get('log_file', 'app.log')),
+
+        # 绘图相关
+        "PLOT_SETTINGS": yaml_conf.get('plot', {}),
+    }
+
+_ENV_NAMES = {"API_KEY", "NEO4J_URI", "NEO4J_USER", "NEO4J_PASSWORD"}
+_loaded = set()
+
+def __getattr__(name):
+    """首次访问配置变量时才执行对应的加载函数，结果写回模块全局变量，之后的访问不再经过这里"""
+    if name.startswith("__"):
+        raise AttributeError(name)
+
+    loader = _load_env_settings if name in _ENV_NAMES else _load_yaml_settings
+    if loader not in _loaded:
+        _loaded.add(loader)
+        globals().update(loader())
+
+    if name in globals():
+        return globals()[name]
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 # ================= 初始化日志配置 =================
+def _force_utf8_stdio():
+    """强制设置标准输出为 UTF-8，解决 Windows 下 Emoji 导致的 GBK 编码错误"""
+    if sys.platform != "win32":
+        return
+    try:
+        sys.stdout = io.TextIOWrapper(sys.stdout.buffer, encoding='utf-8')
+        sys.stderr = io.TextIOWrapper(sys.stderr.buffer, encoding='utf-8')
+    except AttributeError:
+        # 在某些 IDE (如 pytest 或旧版 Notebook) 中 buffer 可能不可用
+        pass
+
 def setup_logging():
-    log_dir = os.path.dirname(LOG_FILE)
+    _force_utf8_stdio()
+
+    log_file = __getattr__('LOG_FILE')
+    log_dir = os.path.dirname(log_file)
     if not os.path.exists(log_dir):
         os.makedirs(log_dir)
 
@@ -90,7 +202,7 @@ def setup_logging():
     console_handler.setFormatter(logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s'))
     
     # 2. 文件输出 Handler
-    file_handler = logging.FileHandler(LOG_FILE, mode='w', encoding='utf-8')
+    file_handler = logging.FileHandler(log_file, mode='w', encoding='utf-8')
     file_handler.setFormatter(logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s'))
 
     root_logger = logging.getLogger()
@@ -0,0 +1,247 @@
+import hashlib
+import json
+import logging
+import random
+from collections import Counter, defaultdict
+from config import settings
+from core.llm_client import get_openai_client
+from core.embedding import get_embeddings_batch
+from core.profiler import profiled
+
+logger = logging.getLogger(__name__)
+
+SUMMARY_PROMPT = """你是一个知识库整理助手。下面是笔记知识图谱中联系紧密的一组概念 (一个社区)。
+请用中文写一段 150~300 字的摘要，概括这组概念共同围绕的主题、关键结论以及它们之间的联系。
+只依据给出的信息，不要编造。直接输出摘要正文。
+
+【概念】
+{members}
+
+【概念之间的关系】
+{relations}
+
+【相关笔记片段】
+{chunks}
+"""
+
+
+def _component_seed(nodes):
+    """由连通分量的节点名计算随机种子：分量不变时划分结果不变，与图中其他部分无关"""
+    return int(hashlib.sha1("\n".join(sorted(nodes)).encode('utf-8')).hexdigest()[:8], 16)
+
+
+def label_propagation(adjacency, max_iterations=20, seed=None):
+    """
+    标签传播聚类：每个节点反复采用邻居中权重最高的标签，直到不再变化
+    每轮按随机顺序遍历节点、平局时随机选取 (固定取最小标签会让一个标签淹没整张图)；
+    调用方按连通分量分别调用，种子默认由分量自身的节点名计算，
+    图中其他位置新增的边不会改变这个分量的遍历顺序和平局选择，社区 id 才能保持稳定
+    :param adjacency: Dict[节点, Dict[邻居, 权重]]
+    :return: List[List[节点]]，每个社区内部按名字排序
+    """
+    rng = random.Random(_component_seed(adjacency) if seed is None else seed)
+    labels = {node: node for node in adjacency}
+    order = sorted(adjacency)
+    for _ in range(max_iterations):
+        changed = False
+        rng.shuffle(order)
+        for node in order:
+            neighbors = adjacency[node]
+            if not neighbors:
+                continue
+            weights = Counter()
+            for neighbor, weight in neighbors.items():
+                weights[labels[neighbor]] += weight
+            best = max(weights.values())
+            candidates = sorted(label for label, weight in weights.items() if weight == best)
+            if labels[node] in candidates:
+                continue
+            labels[node] = rng.choice(candidates)
+            changed = True
+        if not changed:
+            break
+
+    groups = defaultdict(list)
+    for node, label in labels.items():
+        groups[label].append(node)
+    return [sorted(members) for members in groups.values()]
+
+
+def _connected_components(adjacency):
+    """无向图的连通分量 List[List[节点]]，每个分量内部按名字排序"""
+    seen = set()
+    components = []
+    for start in sorted(adjacency):
+        if start in seen:
+            continue
+        seen.add(start)
+        stack, component = [start], []
+        while stack:
+            node = stack.pop()
+            component.append(node)
+            for neighbor in adjacency[node]:
+                if neighbor not in seen:
+                    seen.add(neighbor)
+                    stack.append(neighbor)
+        components.append(sorted(component))
+    return components
+
+
+def _build_adjacency(edges):
+    """把有向的关系边转换为无向加权图 (两个概念间的关系越多，权重越高)"""
+    adjacency = defaultdict(Counter)
+    for edge in edges:
+        head, tail = edge["head"], edge["tail"]
+        if head == tail:
+            continue
+        adjacency[head][tail] += 1
+        adjacency[tail][head] += 1
+    return adjacency
+
+
+def make_community_id(members):
+    """社区 id：按成员集合计算，成员不变时 id 不变"""
+    return hashlib.sha1("\n".join(sorted(members)).encode('utf-8')).hexdigest()[:16]
+
+
+def _fingerprint(members, member_sources, source_hashes):
+    """
+    社区指纹：成员 + 成员涉及的每个来源的版本号
+    只有成员变化或成员所在的笔记内容变化时指纹才会变，摘要才需要重新生成
+    """
+    sources = sorted({source for member in members for source in member_sources.get(member, ())})
+    payload = {"members": sorted(members), "sources": {source: source_hashes.get(source) for source in sources}}
+    return hashlib.sha1(json.dumps(payload, ensure_ascii=False, sort_keys=True).encode('utf-8')).hexdigest()
+
+
+def _summarize(neo4j_mgr, members, edges):
+    """调用 LLM 为一个社区生成摘要"""
+    member_set = set(members)
+    shown = members[:settings.COMMUNITY_MAX_MEMBERS_IN_PROMPT]
+    relations = [
+        f"- {edge['head']} -[{edge['relation']}]-> {edge['tail']}"
+        for edge in edges if edge["head"] in member_set and edge["tail"] in member_set
+    ][:settings.COMMUNITY_MAX_MEMBERS_IN_PROMPT]
+    chunks = [
+        f"- ({item['entity']}) {item['content']}"
+        for item in neo4j_mgr.get_concept_chunks(shown, limit=settings.COMMUNITY_MAX_CHUNKS_IN_PROMPT)
+    ]
+
+    prompt = SUMMARY_PROMPT.format(
+        members="、".join(shown),
+        relations="\n".join(relations) or "(无)",
+        chunks="\n".join(chunks) or "(无)",
+    )
+    try:
+        response = get_openai_client().chat.completions.create(
+            model=settings.MODEL_NAME,
+            messages=[{"role": "user", "content": prompt}],
+            temperature=settings.TEMPERATURE
+        )
+        return (response.choices[0].message.content or "").strip()
+    except Exception as e:
+        logger.error(f"❌ 生成社区摘要失败: {e}")
+        return ""
+
+
+@profiled("refresh_communities")
+def refresh_communities(neo4j_mgr, changed_sources=None, force=False):
+    """
+    离线的社区摘要阶段 (在 run_graph_pipeline 之后执行)：
+    1. 读取概念图并拆分为连通分量
+    2. 只对 "脏" 的分量重新做标签传播 (纯内存计算)：包含本次变更来源中的概念、
+       已有社区的成员/指纹对不上 (概念被删除、所在笔记内容变化、分量被拆开或合并)，或者还没有任何社区的分量；
+       其余分量保留数据库中已有的社区，不重新划分
+    3. 重新划分的社区与数据库中的指纹比对，只为新出现或成员/来源内容有变化的社区重新生成摘要和向量
+    4. 删除已经不存在的社区
+    :param changed_sources: 本次写入或删除过的 source_id；为空且不是 force 时直接跳过
+    :param force: 忽略指纹，重新划分并重新生成全部社区摘要
+    """
+    if not settings.COMMUNITY_ENABLED or not neo4j_mgr or not neo4j_mgr.driver:
+        return
+    if not changed_sources and not force:
+        logger.info("⏭️ 没有笔记发生变更，跳过社区摘要更新")
+        return
+
+    edges, member_sources = neo4j_mgr.get_concept_graph()
+    # 关系本身的来源也算作成员的来源
+    for edge in edges:
+        if edge.get("source"):
+            for name in (edge["head"], edge["tail"]):
+                member_sources.setdefault(name, [])
+                if edge["source"] not in member_sources[name]:
+                    member_sources[name].append(edge["source"])
+
+    adjacency = _build_adjacency(edges)
+    components = _connected_components(adjacency)
+    component_of = {node: i for i, nodes in enumerate(components) for node in nodes}
+    source_hashes = neo4j_mgr.get_source_hashes()
+    existing = neo4j_mgr.get_communities()
+
+    # 找出需要重新划分的分量
+    changed = set(changed_sources or ())
+    if force:
+        dirty = set(range(len(components)))
+    else:
+        dirty = {component_of[name] for name, sources in member_sources.items()
+                 if name in component_of and changed.intersection(sources)}
+    covered = set()
+    for info in existing.values():
+        members = info["members"]
+        indices = {component_of.get(member) for member in members}
+        intact = (members and None not in indices and len(indices) == 1
+                  and _fingerprint(members, member_sources, source_hashes) == info["fingerprint"])
+        if intact:
+            covered |= indices
+        else:
+            dirty |= indices - {None}
+    # 还没有社区的分量 (新出现的，或上次摘要生成失败的) 也重新划分；划分结果是确定的，没有变化时不会调用 LLM
+    dirty |= {i for i, nodes in enumerate(components) if i not in covered and len(nodes) >= settings.COMMUNITY_MIN_SIZE}
+
+    # 干净分量中的社区原样保留
+    kept = {community_id for community_id, info in existing.items()
+            if info["members"] and all(component_of.get(member) not in dirty and member in component_of for member in info["members"])}
+
+    pending = []
+    current_ids = set(kept)
+    communities = 0
+    for i in sorted(dirty):
+        component_adjacency = {node: adjacency[node] for node in components[i]}
+        for members in label_propagation(component_adjacency, settings.COMMUNITY_MAX_ITERATIONS):
+            if len(members) < settings.COMMUNITY_MIN_SIZE:
+                continue
+            communities += 1
+            community_id = make_community_id(members)
+            current_ids.add(community_id)
+            fingerprint = _fingerprint(members, member_sources, source_hashes)
+            if force or existing.get(community_id, {}).get("fingerprint") != fingerprint:
+                pending.append((community_id, members, fingerprint))
+
+    stale = set(existing) - current_ids
+    logger.info(f"🏘️ {len(components)} 个连通分量中 {len(dirty)} 个需要重新划分，得到 {communities} 个社区 (保留 {len(kept)} 个未受影响的社区)，"
+                f"其中 {len(pending)} 个需要重新生成摘要，{len(stale)} 个已过期")
+
+    # embedding 迁移期间摘要向量同时按新旧两个模型计算；查询使用的生效版本必须成功，另一个版本缺失时由 --reembed 补全
+    targets = neo4j_mgr.get_embedding_targets()
+    active_id = neo4j_mgr.get_active_embedding_version()["id"]
+
+    batch_size = 10
+    for start in range(0, len(pending), batch_size):
+        batch = pending[start:start + batch_size]
+        summaries = [_summarize(neo4j_mgr, members, edges) for _, members, _ in batch]
+        texts = [summary for summary in summaries if summary]
+        embedding_iters = {
+            version["id"]: iter(get_embeddings_batch(texts, model=version["model"], dimensions=version["dim"]))
+            for version in targets
+        }
+
+        for (community_id, members, fingerprint), summary in zip(batch, summaries):
+            embeddings = {vid: next(embedding_iter) for vid, embedding_iter in embedding_iters.items()} if summary else {}
+            if not summary or not embeddings.get(active_id):
+                # 不写入社区；所在分量下次变化、或分量中没有任何社区时会重新划分并重试
+                logger.warning(f"⚠️ 社区 {community_id} ({members[0]} 等 {len(members)} 个概念) 摘要生成失败，稍后重试")
+                continue
+            if neo4j_mgr.save_community(community_id, members, summary, embeddings, fingerprint):
+                logger.info(f"🏘️ 已更新社区 {community_id}: {members[0]} 等 {len(members)} 个概念")
+
+    neo4j_mgr.delete_communities(stale)
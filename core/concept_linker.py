@@ -0,0 +1,153 @@
+import logging
+import time
+from collections import deque
+from config import settings
+from core.entity_resolver import EntityResolver, normalize_key
+
+logger = logging.getLogger(__name__)
+
+
+def _is_word_char(ch):
+    """ASCII 字母数字：英文概念名需要按词边界匹配，避免 "Go" 命中 "Google" """
+    return ch.isascii() and (ch.isalnum() or ch == "_")
+
+
+class ConceptLinker:
+    """
+    查询时的实体链接：在内存中用所有 Concept.name (以及消歧索引中的别名) 构建 Aho-Corasick 自动机，
+    一次扫描即可找出问题中提到的全部概念，用来在向量检索之外直接从图谱取上下文
+    - 匹配基于 normalize_key (NFKC + 忽略大小写)，与入库时的实体消歧保持一致
+    - 增量刷新：只拉取 created_at 晚于上次刷新的 Concept，新增模式后重建失败指针 (只涉及内存中的 trie)
+    """
+
+    def __init__(self, neo4j_mgr=None):
+        self.neo4j = neo4j_mgr
+        # trie: 每个状态一个 dict (字符 -> 下一个状态)；fail 为失败指针；output 为在该状态结束的 (key, 规范名)
+        self._goto = [{}]
+        self._fail = [0]
+        self._output = [[]]
+        self._patterns = {}
+        self._dirty = False
+
+        # 上次刷新时数据库中最新的 Concept.created_at，以及上次刷新的时间
+        self._since = None
+        self._last_refresh = 0.0
+
+        self._load_aliases()
+
+    def __len__(self):
+        return len(self._patterns)
+
+    def _load_aliases(self):
+        """别名表和消歧索引中记录的写法 -> 规范名"""
+        if not settings.ENTITY_RESOLUTION_ENABLED:
+            return
+        try:
+            resolver = EntityResolver()
+        except Exception as e:
+            logger.warning(f"⚠️ 读取实体消歧索引失败，概念链接只使用概念名: {e}")
+            return
+        for key, canonical in resolver.surface.items():
+            self._add_key(key, canonical)
+
+    def add(self, name, canonical=None):
+        """登记一个概念名 (或别名 -> 规范名)"""
+        self._add_key(normalize_key(name), canonical or name)
+
+    def _add_key(self, key, canonical):
+        if len(key) < settings.CONCEPT_LINKING_MIN_NAME_LENGTH or key in self._patterns:
+            return
+        self._patterns[key] = canonical
+
+        state = 0
+        for ch in key:
+            nxt = self._goto[state].get(ch)
+            if nxt is None:
+                nxt = len(self._goto)
+                self._goto[state][ch] = nxt
+                self._goto.append({})
+            state = nxt
+        self._dirty = True
+
+    def _build_failure_links(self):
+        """BFS 计算失败指针，并把失败链上的输出合并到当前状态"""
+        # 输出每次都从各模式的终止状态重新计算，避免增量重建时重复累加
+        self._fail = [0] * len(self._goto)
+        self._output = [[] for _ in self._goto]
+        for key, canonical in self._patterns.items():
+            state = 0
+            for ch in key:
+                state = self._goto[state][ch]
+            self._output[state] = [(key, canonical)]
+
+        # 根节点的子节点失败指针指向根
+        queue = deque(self._goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for ch, nxt in self._goto[state].items():
+                fallback = self._fail[state]
+                while fallback and ch not in self._goto[fallback]:
+                    fallback = self._fail[fallback]
+                self._fail[nxt] = self._goto[fallback].get(ch, 0)
+                self._output[nxt] = self._output[nxt] + self._output[self._fail[nxt]]
+                queue.append(nxt)
+        self._dirty = False
+
+    def refresh(self, force=False):
+        """
+        从 Neo4j 增量同步新出现的概念 (按 Concept.created_at)
+        距上次刷新不足 refresh_interval 秒时直接返回，查询热路径上不访问数据库
+        """
+        if not self.neo4j or not self.neo4j.driver:
+            return
+        now = time.monotonic()
+        if not force and self._last_refresh and now - self._last_refresh < settings.CONCEPT_LINKING_REFRESH_INTERVAL:
+            return
+        self._last_refresh = now
+
+        names, latest = self.neo4j.get_concept_names_since(self._since)
+        for name in names:
+            self.add(name)
+        if latest is not None:
+            self._since = latest
+        if names:
+            logger.info(f"🔤 概念链接索引新增 {len(names)} 个概念 (共 {len(self)} 个写法)")
+
+    def find(self, text):
+        """
+        找出文本中提到的概念，返回按出现顺序去重的规范名列表
+        重叠的匹配只保留最长的一个 ("Docker Compose" 优先于 "Docker")
+        """
+        if not text or not self._patterns:
+            return []
+        if self._dirty:
+            self._build_failure_links()
+
+        text = normalize_key(text)
+        matches = []
+        state = 0
+        for end, ch in enumerate(text, start=1):
+            while state and ch not in self._goto[state]:
+                state = self._fail[state]
+            state = self._goto[state].get(ch, 0)
+            for key, canonical in self._output[state]:
+                start = end - len(key)
+                # 英文名需要落在词边界上
+                if _is_word_char(key[0]) and start > 0 and _is_word_char(text[start - 1]):
+                    continue
+                if _is_word_char(key[-1]) and end < len(text) and _is_word_char(text[end]):
+                    continue
+                matches.append((start, end, canonical))
+
+        # 先长后短地选取互不重叠的匹配
+        matches.sort(key=lambda m: (m[0] - m[1], m[0]))
+        taken = []
+        for start, end, canonical in matches:
+            if all(end <= s or start >= e for s, e, _ in taken):
+                taken.append((start, end, canonical))
+
+        seen = []
+        for _, _, canonical in sorted(taken):
+            if canonical not in seen:
+                seen.append(canonical)
+        return seen
@@ -1,52 +1,141 @@
+import base64
 import logging
-from openai import OpenAI
+import math
+import re
+import sys
+from array import array
 from config import settings
+from core.llm_client import get_openai_client
 
 logger = logging.getLogger(__name__)
 
-def get_embedding(text):
+# 向量在进程内统一用连续的 float32 数组 (array('f')) 表示，
+# 1024 维只占 4KB，而 List[float] 需要 1024 个 Python float 对象 (约 32KB)
+# 只有在交给 Neo4j 驱动或写 JSON 时才转换为 list
+
+def to_float32(values):
+    """
+    把 API 返回值 / 缓存中的向量转换为 array('f')
+    支持 List[float]、array 以及 base64 编码的小端 float32 字节串
+    """
+    if values is None:
+        return array('f')
+    if isinstance(values, array) and values.typecode == 'f':
+        return values
+    if isinstance(values, str):
+        return float32_from_bytes(base64.b64decode(values))
+    return array('f', values)
+
+def float32_from_bytes(data):
+    """从小端 float32 字节串还原向量"""
+    vec = array('f')
+    vec.frombytes(data)
+    if sys.byteorder == 'big':
+        vec.byteswap()
+    return vec
+
+def float32_to_bytes(vec):
+    """把向量编码为小端 float32 字节串 (用于缓存文件)"""
+    vec = to_float32(vec)
+    if sys.byteorder == 'big':
+        vec = array('f', vec)
+        vec.byteswap()
+    return vec.tobytes()
+
+def to_base64(vec):
+    """向量 -> base64 字符串 (用于 JSON 中紧凑存储)"""
+    return base64.b64encode(float32_to_bytes(vec)).decode('ascii')
+
+def as_driver_list(vec):
+    """在 Neo4j 驱动边界才把向量转换成 List[float]"""
+    if vec is None:
+        return None
+    return vec.tolist() if isinstance(vec, array) else list(vec)
+
+def reduce_embedding(vec, dim):
+    """
+    降维：截取前 dim 维 (text-embedding-v3 等模型的前若干维保留了大部分语义信息)
+    索引使用余弦相似度，与向量长度无关，因此截断后无需重新归一化
+    """
+    vec = to_float32(vec)
+    return vec if len(vec) <= dim else vec[:dim]
+
+def cosine_similarity(a, b):
+    """两个向量的余弦相似度"""
+    dot = sum(x * y for x, y in zip(a, b))
+    norm = math.sqrt(sum(x * x for x in a)) * math.sqrt(sum(y * y for y in b))
+    return dot / norm if norm else 0.0
+
+def embedding_version(model=None, dim=None):
+    """
+    embedding 版本号：模型名 + 维度，例如 text-embedding-v3@1024
+    不同版本的向量互不兼容，不能写进同一个向量索引
+    """
+    return f"{model or settings.EMBEDDING_MODEL}@{dim or settings.EMBEDDING_DIM}"
+
+def version_slug(version):
+    """把版本号转换为可以用在属性名、索引名和文件名中的形式 (text_embedding_v3_1024)"""
+    return re.sub(r'[^0-9A-Za-z]+', '_', version).strip('_').lower()
+
+def legacy_embedding_version(dim=None):
+    """
+    引入 embedding 版本之前写入的向量 (Neo4j 中的 embedding 属性、storage/ 中不带版本号的缓存) 由哪个版本生成
+    旧数据本身没有记录模型，只能由配置 embedding_migration.legacy_model 声明；不能用当前配置代替，
+    否则升级时顺便换了模型，旧向量就会被当作新模型的结果
+    :param dim: 旧向量实际的维度，默认为配置的维度
+    :return: 版本号；未声明时返回 None (来源不明的旧向量不予采用)
+    """
+    model = settings.EMBEDDING_MIGRATION_LEGACY_MODEL
+    return embedding_version(model, dim) if model else None
+
+def get_embedding(text, model=None, dimensions=None):
     """
     调用 embedding 模型将文本转换为向量
     :param text: 输入文本
-    :return: 向量 (List[float])
+    :param model / dimensions: 默认使用配置中的模型；迁移期间查询旧版本索引时需要指定旧模型
+    :return: 向量 (array('f'))，失败返回空数组
     """
     if not text or not isinstance(text, str):
-        return []
+        return array('f')
 
-    client = OpenAI(api_key=settings.API_KEY, base_url=settings.BASE_URL)
+    client = get_openai_client()
 
     try:
         # 注意: 这里的 model 必须是 embedding 模型名称
         response = client.embeddings.create(
-            model=settings.EMBEDDING_MODEL,
+            model=model or settings.EMBEDDING_MODEL,
             input=text,
-            dimensions=settings.EMBEDDING_DIM, # 部分模型支持指定维度
-            encoding_format="float"
+            dimensions=dimensions or settings.EMBEDDING_DIM, # 部分模型支持指定维度
+            encoding_format=settings.EMBEDDING_ENCODING_FORMAT
         )
-        return response.data[0].embedding
+        return to_float32(response.data[0].embedding)
     except Exception as e:
         logger.error(f"❌ Embedding 生成失败: {e}")
-        return []
+        return array('f')
 
-def get_embeddings_batch(texts):
+def get_embeddings_batch(texts, model=None, dimensions=None):
     """
     批量生成向量
+    :param model / dimensions: 默认使用配置中的模型
+    :return: List[array('f')]，与 texts 顺序一致；失败时对应位置为 None
     """
     if not texts:
         return []
-    
-    client = OpenAI(api_key=settings.API_KEY, base_url=settings.BASE_URL)
-    
+
+    client = get_openai_client()
+
     try:
         response = client.embeddings.create(
-            model=settings.EMBEDDING_MODEL,
+            model=model or settings.EMBEDDING_MODEL,
             input=texts,
-            dimensions=settings.EMBEDDING_DIM,
-            encoding_format="float"
+            dimensions=dimensions or settings.EMBEDDING_DIM,
+            encoding_format=settings.EMBEDDING_ENCODING_FORMAT
         )
-        # 按照 index 排序返回，保证顺序一致
-        sorted_data = sorted(response.data, key=lambda x: x.index)
-        return [item.embedding for item in sorted_data]
+        # 按照 index 放回原位，保证顺序一致 (不再额外排序复制)
+        embeddings = [None] * len(texts)
+        for item in response.data:
+            embeddings[item.index] = to_float32(item.embedding)
+        return embeddings
     except Exception as e:
         logger.error(f"❌ 批量 Embedding 生成失败: {e}")
         return [None] * len(texts)
@@ -0,0 +1,225 @@
+import json
+import logging
+import os
+import re
+import unicodedata
+from config import settings
+from core.embedding import to_float32, to_base64, cosine_similarity, embedding_version, legacy_embedding_version
+
+logger = logging.getLogger(__name__)
+
+_WHITESPACE = re.compile(r"\s+")
+
+
+def clean_name(name):
+    """统一全角/半角并合并空白，保留原有大小写 (作为新概念的规范名)"""
+    return _WHITESPACE.sub(" ", unicodedata.normalize("NFKC", name or "")).strip()
+
+def normalize_key(name):
+    """索引用的 key：在 clean_name 基础上忽略大小写"""
+    return clean_name(name).casefold()
+
+
+class EntityResolver:
+    """
+    入库前的实体消歧：把同一概念的不同写法映射到同一个规范名，再写入 Neo4j
+    1. 规范化规则: NFKC、合并空白、忽略大小写 ("docker " -> "Docker")
+    2. 别名表: config/aliases.yaml 中手工维护的 规范名 -> [别名]
+    3. 泛化后缀: 去掉 "容器" 等后缀后命中已有概念时合并 ("Docker容器" -> "Docker")
+    4. (可选) Embedding 相似度: 概念名向量与已有概念的余弦相似度超过阈值时合并
+    索引常驻内存，并持久化到 storage/entity_index.json
+    """
+
+    def __init__(self, known_names=None, index_path=None):
+        self.index_path = index_path or os.path.join(settings.ROOT_DIR, 'storage', 'entity_index.json')
+        # 任意写法的 key -> 规范名
+        self.surface = {}
+        # 规范名 -> 概念名向量 (仅在开启 Embedding 相似度时使用)
+        self.embeddings = {}
+        self._dirty = False
+
+        self._load_index()
+        for name in known_names or []:
+            self.register(name)
+        self._load_aliases()
+
+    def _load_index(self):
+        if not os.path.exists(self.index_path):
+            return
+        try:
+            with open(self.index_path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            self.surface = data.get("surface", {})
+            # 换了 embedding 模型/维度后，旧的概念向量不能再参与比较，丢弃后按需重新计算
+            # 旧版索引没有记录版本，按声明的旧模型 (embedding_migration.legacy_model) 和向量实际的维度判断
+            embeddings = data.get("embeddings", {})
+            stored_version = data.get("embedding_version") or legacy_embedding_version(
+                len(to_float32(next(iter(embeddings.values())))) if embeddings else None
+            )
+            if stored_version == embedding_version():
+                self.embeddings = {name: to_float32(vec) for name, vec in embeddings.items()}
+            elif data.get("embeddings"):
+                logger.info("ℹ️ 实体索引中的向量来自其他 embedding 版本，将重新计算")
+                self._dirty = True
+        except Exception as e:
+            logger.error(f"❌ 读取实体索引失败，将重新构建: {e}")
+
+    def _load_aliases(self):
+        """别名表优先级最高，覆盖索引中已有的映射"""
+        alias_file = settings.ENTITY_ALIAS_FILE
+        if not alias_file or not os.path.exists(alias_file):
+            return
+
+        from utils import load_yaml_config
+        try:
+            aliases = load_yaml_config(alias_file) or {}
+        except Exception as e:
+            logger.error(f"❌ 读取别名表失败: {e}")
+            return
+
+        for canonical, surface_forms in aliases.items():
+            canonical = clean_name(str(canonical))
+            for form in [canonical] + list(surface_forms or []):
+                key = normalize_key(str(form))
+                if key and self.surface.get(key) != canonical:
+                    self.surface[key] = canonical
+                    self._dirty = True
+
+    def register(self, name):
+        """把已存在的概念登记为规范名"""
+        key = normalize_key(name)
+        if key and key not in self.surface:
+            self.surface[key] = clean_name(name)
+            self._dirty = True
+
+    def _lookup(self, key):
+        """按 规范化 -> 别名 -> 泛化后缀 的顺序查找规范名"""
+        if key in self.surface:
+            return self.surface[key]
+
+        for suffix in settings.ENTITY_GENERIC_SUFFIXES:
+            suffix = normalize_key(suffix)
+            # "Docker容器" 命中已有的 "Docker"
+            if key.endswith(suffix) and len(key) - len(suffix) >= 2:
+                stripped = key[:-len(suffix)].strip()
+                if stripped in self.surface:
+                    return self.surface[stripped]
+            # "Docker" 命中已有的 "Docker容器"
+            if key + suffix in self.surface:
+                return self.surface[key + suffix]
+        return None
+
+    def _ensure_canonical_embeddings(self, batch_size=10):
+        """为还没有向量的规范名补全向量 (首次开启相似度合并时一次性计算，之后持久化复用)"""
+        from core.embedding import get_embeddings_batch
+
+        missing = sorted(set(self.surface.values()) - set(self.embeddings))
+        for start in range(0, len(missing), batch_size):
+            batch = missing[start:start + batch_size]
+            for name, vec in zip(batch, get_embeddings_batch(batch)):
+                if vec:
+                    self.embeddings[name] = vec
+                    self._dirty = True
+
+    def _match_by_embedding(self, names):
+        """用概念名向量为无法按规则匹配的名字找最相似的已有概念"""
+        from core.embedding import get_embeddings_batch
+
+        self._ensure_canonical_embeddings()
+        matches = {}
+        vectors = get_embeddings_batch(names)
+        for name, vec in zip(names, vectors):
+            if not vec:
+                continue
+            best_name, best_score = None, 0.0
+            for canonical, canonical_vec in self.embeddings.items():
+                score = cosine_similarity(vec, canonical_vec)
+                if score > best_score:
+                    best_name, best_score = canonical, score
+
+            if best_name and best_score >= settings.ENTITY_SIMILARITY_THRESHOLD:
+                logger.info(f"🔗 相似度合并: {name} -> {best_name} ({best_score:.3f})")
+                matches[name] = best_name
+            else:
+                # 成为新的规范名，记录向量供之后比较
+                self.embeddings[clean_name(name)] = vec
+        return matches
+
+    def resolve_names(self, names):
+        """
+        批量解析名字，返回 Dict[原始名字, 规范名]
+        新出现的名字会登记为新的规范名
+        """
+        resolved = {}
+        unresolved = []
+        for name in names:
+            if name in resolved or name in unresolved:
+                continue
+            canonical = self._lookup(normalize_key(name))
+            if canonical:
+                resolved[name] = canonical
+            else:
+                unresolved.append(name)
+
+        if unresolved and settings.ENTITY_USE_EMBEDDING:
+            matches = self._match_by_embedding(unresolved)
+            resolved.update(matches)
+            unresolved = [name for name in unresolved if name not in matches]
+
+        for name in unresolved:
+            # 逐个登记并重新查找，保证同一批中不同写法的新名字也能互相合并
+            key = normalize_key(name)
+            canonical = self._lookup(key)
+            if not canonical:
+                canonical = clean_name(name)
+                self.surface[key] = canonical
+                self._dirty = True
+            resolved[name] = canonical
+
+        for name, canonical in resolved.items():
+            key = normalize_key(name)
+            if key and key not in self.surface:
+                self.surface[key] = canonical
+                self._dirty = True
+        return resolved
+
+    def apply(self, triplets, chunks):
+        """
+        把三元组和块中的实体名替换为规范名
+        合并后首尾相同的自环三元组会被丢弃
+        :return: (triplets, chunks)
+        """
+        names = [item[field] for item in triplets for field in ("head", "tail")]
+        names += [item["subject"] for item in chunks]
+        mapping = self.resolve_names(names)
+
+        merged = sum(1 for name, canonical in mapping.items() if name != canonical)
+        if merged:
+            logger.info(f"🔗 实体消歧: {merged} 个写法被映射到已有概念")
+
+        resolved_triplets = []
+        for item in triplets:
+            head, tail = mapping[item["head"]], mapping[item["tail"]]
+            if head == tail:
+                continue
+            resolved_triplets.append({**item, "head": head, "tail": tail})
+
+        resolved_chunks = [{**item, "subject": mapping[item["subject"]]} for item in chunks]
+        return resolved_triplets, resolved_chunks
+
+    def save(self):
+        """持久化索引 (只有变化时才写盘)"""
+        if not self._dirty:
+            return
+        index_dir = os.path.dirname(self.index_path)
+        if not os.path.exists(index_dir):
+            os.makedirs(index_dir)
+
+        tmp_path = self.index_path + ".tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            # 向量以 base64 编码的 float32 存储，比 JSON 数字紧凑得多
+            embeddings = {name: to_base64(vec) for name, vec in self.embeddings.items()}
+            json.dump({"surface": self.surface, "embeddings": embeddings, "embedding_version": embedding_version()}, f, ensure_ascii=False)
+        os.replace(tmp_path, self.index_path)
+        self._dirty = False
+        logger.info(f"💾 实体索引已保存 ({len(self.surface)} 个写法)")
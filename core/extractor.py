@@ -1,13 +1,37 @@
 import json
 import logging
 import os
+import re
 import hashlib
-from openai import OpenAI
+import time
 from config import settings
-from core.embedding import get_embeddings_batch
+from core.llm_client import get_openai_client
+from core.embedding import get_embeddings_batch, to_float32, float32_from_bytes, float32_to_bytes, embedding_version, version_slug, legacy_embedding_version
+from core.output_parser import parse_extraction_output, parse_json_lenient, validate_extraction
+from core.profiler import profiled
 
 logger = logging.getLogger(__name__)
 
+# 批量模式下每篇笔记的分隔符，LLM 需按 id 分别输出
+BATCH_NOTE_START = "<<<NOTE id={source_id}>>>"
+BATCH_NOTE_END = "<<<END id={source_id}>>>"
+
+BATCH_INSTRUCTION = """【批量模式】下面包含 {count} 篇互相独立的笔记，每篇以 <<<NOTE id=...>>> 开始、以 <<<END id=...>>> 结束。
+请对每篇笔记分别按上述规则提取，不要把不同笔记的信息混在一起。
+输出一个 JSON 对象，键为笔记 id，值为该笔记的 {{"triplets": [...], "chunks": [...]}}，例如：
+{{"note_a": {{"triplets": [], "chunks": []}}, "note_b": {{"triplets": [], "chunks": []}}}}
+"""
+
+# 只抢救出部分结果时，写入 Neo4j 的版本号带此后缀，下次完整提取后版本号不同，会触发重写
+PARTIAL_HASH_SUFFIX = ":partial"
+
+# 对解析失败的字段重新提问时追加的要求
+REPAIR_INSTRUCTION = """【补充要求】上一次的输出被截断或格式错误。请只重新输出 {keys} 字段，格式为 JSON 对象，例如：{example}
+不要输出其他字段，不要包含 Markdown 代码块。"""
+
+_CJK_PATTERN = re.compile(r'[\u3000-\u303f\u4e00-\u9fff\uff00-\uffef]')
+
+
 def get_cache_path(content, key_identifier):
     """
     计算内容的哈希值并返回缓存文件路径
@@ -20,23 +44,23 @@ def get_cache_path(content, key_identifier):
 
     # 计算新 Hash
     hash_md5 = hashlib.md5(content.encode('utf-8')).hexdigest()
-    
+
     # 构造新的缓存文件名: 这里的 key_identifier 建议传入文件名，例如 "UE5"
     # 文件名格式: {文件名}.{Hash}.json
     # 这样做的好处是我们可以通过前缀快速找到旧版本缓存
     new_cache_filename = f"{key_identifier}.{hash_md5}.json"
     new_cache_path = os.path.join(storage_dir, new_cache_filename)
-    
+
     # 如果这个确切的文件已经存在，说明完全没变，直接返回
     if os.path.exists(new_cache_path):
         return new_cache_path
 
     # 如果这个文件不存在，说明内容变了（Hash变了）
-    # 此时我们需要清理掉这个 key_identifier 对应的所有人旧缓存
+    # 此时我们需要清理掉这个 key_identifier 对应的所有人旧缓存 (包括 .f32 向量文件)
     # 遍历 storage 目录
     for filename in os.listdir(storage_dir):
-        # 检查是否是同一个文件的旧缓存 (以 key_identifier + "." 开头，且不是当前这个新文件)
-        if filename.startswith(f"{key_identifier}.") and filename != new_cache_filename:
+        # 检查是否是同一个文件的旧缓存 (以 key_identifier + "." 开头，且不属于当前这个新版本)
+        if filename.startswith(f"{key_identifier}.") and not filename.startswith(f"{key_identifier}.{hash_md5}."):
             old_path = os.path.join(storage_dir, filename)
             try:
                 os.remove(old_path)
@@ -46,132 +70,437 @@ def get_cache_path(content, key_identifier):
 
     return new_cache_path
 
+def remove_cache(key_identifier):
+    """删除某篇笔记的全部缓存 (笔记被删除时调用)"""
+    storage_dir = os.path.join(settings.ROOT_DIR, 'storage')
+    if not os.path.exists(storage_dir):
+        return
+    for filename in os.listdir(storage_dir):
+        if filename.startswith(f"{key_identifier}."):
+            try:
+                os.remove(os.path.join(storage_dir, filename))
+                logger.info(f"🧹 清理缓存: {filename}")
+            except OSError as e:
+                logger.warning(f"无法删除缓存 {filename}: {e}")
+
+def build_prompt(text, prompt_template):
+    """把笔记内容填入 Prompt 模板"""
+    return prompt_template.replace("CONTENT_PLACEHOLDER", text)
+
+def compute_prompt_hash(prompt):
+    """单篇笔记 Prompt 的 hash，既是缓存 key 也是 Neo4j 中的版本号"""
+    return hashlib.md5(prompt.encode('utf-8')).hexdigest()
+
+def estimate_tokens(text):
+    """
+    粗略估算 token 数 (不依赖 tokenizer)：
+    中文等全角字符约 1 字 1 token，其余字符约 4 个字符 1 token
+    """
+    if not text:
+        return 0
+    cjk_count = len(_CJK_PATTERN.findall(text))
+    return cjk_count + (len(text) - cjk_count + 3) // 4
+
+def _log_text(label, text):
+    """打印长文本时只保留首尾各 100 字"""
+    if len(text) > 200:
+        text = f"{text[:100]} ... [省略 {len(text)-200} 字] ... {text[-100:]}"
+    logger.info(f"{label}\n{text}")
+
+def _call_llm(client, prompt):
+    """调用 LLM 并返回去掉首尾空白的文本"""
+    response = client.chat.completions.create(
+        model=settings.MODEL_NAME,
+        messages=[{"role": "user", "content": prompt}],
+        temperature=settings.TEMPERATURE
+    )
+    return response.choices[0].message.content.strip()
+
+def _embedding_file(cache_file, version=None):
+    """
+    缓存 JSON 对应的向量文件: {文件名}.{Hash}.{embedding 版本}.f32
+    version 为 None 时返回旧版缓存的 {文件名}.{Hash}.f32 (没有版本信息)
+    """
+    base = os.path.splitext(cache_file)[0]
+    return f"{base}.{version_slug(version)}.f32" if version else base + ".f32"
+
+def _remove_stale_embedding_files(cache_file, keep):
+    """行号按当前版本重新分配后，其他版本 (以及旧版无版本) 的向量文件已经对不上，一并删除"""
+    storage_dir = os.path.dirname(cache_file)
+    prefix = os.path.basename(os.path.splitext(cache_file)[0]) + "."
+    for filename in os.listdir(storage_dir):
+        path = os.path.join(storage_dir, filename)
+        if filename.startswith(prefix) and filename.endswith(".f32") and path != keep:
+            try:
+                os.remove(path)
+            except OSError as e:
+                logger.warning(f"无法删除旧向量文件 {filename}: {e}")
+
+def _write_cache(cache_file, data):
+    """
+    将完整的 JSON 对象写入缓存
+    向量不写进 JSON，而是按行连续写入 .f32 二进制文件 (小端 float32)，chunk 中只记录行号 embedding_row
+    向量文件名带 embedding 版本 (模型 + 维度)，换模型后旧向量不会被当作新模型的结果读回
+    """
+    chunks = []
+    row = 0
+    embedding_file = _embedding_file(cache_file, embedding_version())
+    try:
+        with open(embedding_file, 'wb') as f:
+            for chunk in data.get("chunks", []):
+                meta = {key: value for key, value in chunk.items() if key not in ("embedding", "embedding_row")}
+                if chunk.get("embedding"):
+                    f.write(float32_to_bytes(chunk["embedding"]))
+                    meta["embedding_row"] = row
+                    row += 1
+                chunks.append(meta)
+
+        with open(cache_file, 'w', encoding='utf-8') as f:
+            json.dump({**data, "chunks": chunks}, f, ensure_ascii=False, indent=2)
+        _remove_stale_embedding_files(cache_file, keep=embedding_file)
+        return True
+    except Exception as e:
+        logger.error(f"❌ 缓存写入失败: {e}")
+        return False
+
+def _attach_embeddings(cache_file, chunks):
+    """
+    从当前 embedding 版本的 .f32 文件读取向量并挂回 chunks；向量文件缺失或损坏时保持缺失，由 _complete_embeddings 重新补全
+    旧版缓存 (无版本的 .f32 或直接写在 JSON 里的向量) 只有在声明的旧版本 (embedding_migration.legacy_model) 与当前配置一致时才会使用，并转换为新格式
+    :return: 是否读到了旧格式的向量 (需要按新格式回写缓存)
+    """
+    version = embedding_version()
+    embedding_file = _embedding_file(cache_file, version)
+    legacy = False
+    if not os.path.exists(embedding_file) and os.path.exists(_embedding_file(cache_file)):
+        legacy = legacy_embedding_version() == version
+        embedding_file = _embedding_file(cache_file) if legacy else None
+
+    rows = [chunk["embedding_row"] for chunk in chunks if isinstance(chunk.get("embedding_row"), int)]
+    blob = b""
+    if rows and embedding_file and os.path.exists(embedding_file):
+        with open(embedding_file, 'rb') as f:
+            blob = f.read()
+    stride = len(blob) // (max(rows) + 1) if rows else 0
+
+    for chunk in chunks:
+        row = chunk.pop("embedding_row", None)
+        if chunk.get("embedding"):
+            # 不是当前模型生成的向量 (或来源不明) 直接丢弃，由 _complete_embeddings 重新计算
+            vector = to_float32(chunk["embedding"])
+            chunk["embedding"] = vector if legacy_embedding_version(len(vector)) == version else None
+            legacy = True
+        # 维度不符的向量 (例如换维度前留下的旧版缓存) 不能使用
+        elif isinstance(row, int) and stride == settings.EMBEDDING_DIM * 4:
+            chunk["embedding"] = float32_from_bytes(blob[row * stride:(row + 1) * stride])
+    return legacy
+
+def _complete_embeddings(chunks):
+    """
+    检查 chunks 中是否缺失 embedding，缺失则调用 Embedding API 补全
+    :return: 是否有新补全的向量 (需要回写缓存)
+    """
+    missing_embeddings_indices = []
+    texts_to_embed = []
+
+    for i, chunk in enumerate(chunks):
+        if "embedding" not in chunk or not chunk["embedding"]:
+            missing_embeddings_indices.append(i)
+            texts_to_embed.append(chunk["content"])
+
+    if not texts_to_embed:
+        logger.info(f"⏩ 所有文本块均包含 Embedding，跳过向量计算。")
+        return False
+
+    logger.info(f"🧩 检测到 {len(texts_to_embed)} 个文本块缺失 Embedding (共 {len(chunks)} 个)，正在补全...")
+
+    embeddings = get_embeddings_batch(texts_to_embed)
+
+    # 填回 chunks
+    for idx, emb in zip(missing_embeddings_indices, embeddings):
+        chunks[idx]["embedding"] = emb
+    return True
+
+def _quarantine(source_id, prompt_hash, content, failed_keys):
+    """
+    把无法完整解析的返回值隔离到 storage/quarantine，便于人工排查
+    隔离的内容不会写入缓存，下次运行会重新请求
+    """
+    quarantine_dir = os.path.join(settings.ROOT_DIR, 'storage', 'quarantine')
+    if not os.path.exists(quarantine_dir):
+        os.makedirs(quarantine_dir)
+
+    filename = f"{source_id}.{prompt_hash[:8]}.{int(time.time() * 1000)}.json"
+    try:
+        with open(os.path.join(quarantine_dir, filename), 'w', encoding='utf-8') as f:
+            json.dump({"source_id": source_id, "failed_keys": failed_keys, "content": content}, f, ensure_ascii=False, indent=2)
+        logger.warning(f"🚧 返回内容不完整 (字段: {failed_keys})，已隔离至 quarantine/{filename}")
+    except Exception as e:
+        logger.error(f"❌ 隔离文件写入失败: {e}")
+
+def _repair_failed_keys(client, prompt, source_id, triplets, chunks, failed_keys):
+    """
+    只针对解析失败的字段重新提问，成功拿到完整字段后替换抢救出的部分结果
+    :return: (triplets, chunks, failed_keys)
+    """
+    salvaged = {"triplets": triplets, "chunks": chunks}
+
+    for attempt in range(settings.EXTRACTION_MAX_REPAIR_RETRIES):
+        logger.info(f"🔁 [{source_id}] 重新请求不完整的字段 {failed_keys} (第 {attempt + 1} 次)")
+        repair_prompt = prompt + "\n" + REPAIR_INSTRUCTION.format(
+            keys="、".join(failed_keys),
+            example=json.dumps({key: [] for key in failed_keys}, ensure_ascii=False)
+        )
+        try:
+            content = _call_llm(client, repair_prompt)
+        except Exception as e:
+            logger.error(f"❌ 重新请求失败: {e}")
+            break
+
+        repaired_triplets, repaired_chunks, still_failed = parse_extraction_output(content)
+        repaired = {"triplets": repaired_triplets, "chunks": repaired_chunks}
+        for key in list(failed_keys):
+            if key not in still_failed:
+                salvaged[key] = repaired[key]
+                failed_keys.remove(key)
+
+        if not failed_keys:
+            logger.info(f"✅ [{source_id}] 不完整字段已补全")
+            break
+
+    return salvaged["triplets"], salvaged["chunks"], failed_keys
+
+@profiled("extract_hybrid_data")
 def extract_hybrid_data(text, prompt_template, source_id="unknown_source"):
     """
     利用 LLM 提取三元组和块信息
     :param source_id: 唯一标识符，通常传文件名，用于缓存管理
+    :return: (triplets, chunks, current_hash)
+             只抢救出部分结果时 current_hash 带 PARTIAL_HASH_SUFFIX 后缀，保证下次完整提取后会重新写库
     """
-    client = OpenAI(api_key=settings.API_KEY, base_url=settings.BASE_URL)
-    
+    client = get_openai_client()
+
     # 替换 Prompt 中的占位符
     if "CONTENT_PLACEHOLDER" not in prompt_template:
         logger.warning("Prompt 模板中未找到 CONTENT_PLACEHOLDER，可能导致提取失败。")
-        
-    prompt = prompt_template.replace("CONTENT_PLACEHOLDER", text)
+
+    prompt = build_prompt(text, prompt_template)
+    # prompt 的 hash (它包含了原始文本)，即生成 cache_file 时用的 hash，方便上层做版本控制
+    current_hash = compute_prompt_hash(prompt)
 
     logger.info("="*15 + f" 开始分析新笔记 [{source_id}] " + "="*15)
-    
+
     # 1. 打印详细 Prompt (前100字 + 后100字)
-    if len(prompt) > 200:
-        log_prompt = f"{prompt[:100]} ... [省略 {len(prompt)-200} 字] ... {prompt[-100:]}"
-    else:
-        log_prompt = prompt
-    logger.info(f"📤 [Request] 发送给 API 的实际内容:\n{log_prompt}")
-    
+    _log_text("📤 [Request] 发送给 API 的实际内容:", prompt)
+
     # 2. 检查缓存 (传入 source_id)
     cache_file = get_cache_path(prompt, source_id)
-    content = ""
-    is_cached = False
-    
-    if os.path.exists(cache_file):
+    cached = _load_cached_data(cache_file, source_id, current_hash)
+    failed_keys = []
+
+    if cached is not None:
         logger.info(f"📦 此内容已在 storage 中找到缓存 ({os.path.basename(cache_file)})，跳过 API 调用。")
+        triplets, chunks = cached
+    else:
+        # 3. 如果无缓存，调用 API
         try:
-            with open(cache_file, 'r', encoding='utf-8') as f:
-                content = f.read()
-            is_cached = True
-        except Exception as e:
-            logger.error(f"读取缓存文件失败: {e}，准备重新调用 API。")
-            content = ""
-    
-    # 3. 如果无缓存，调用 API
-    if not content:
-        try:
-            response = client.chat.completions.create(
-                model=settings.MODEL_NAME,
-                messages=[{"role": "user", "content": prompt}],
-                temperature=settings.TEMPERATURE
-            )
-            content = response.choices[0].message.content.strip()
-            
-            # 存入缓存
-            try:
-                with open(cache_file, 'w', encoding='utf-8') as f:
-                    f.write(content)
-                logger.info(f"💾 API 返回值已保存至缓存: {cache_file}")
-            except Exception as e:
-                logger.error(f"缓存写入失败: {e}")
-                
+            content = _call_llm(client, prompt)
         except Exception as e:
             logger.error(f"❌ LLM 处理出错: {str(e)}")
             return [], [], ""
 
-    # 4. 打印详细 Response
-    if len(content) > 200:
-        log_content = f"{content[:100]} ... [省略 {len(content)-200} 字] ... {content[-100:]}"
-    else:
-        log_content = content
-    logger.info(f"📥 [Response] API 返回详细内容:\n{log_content}")
+        # 4. 打印详细 Response
+        _log_text("📥 [Response] API 返回详细内容:", content)
+
+        # 5. 容错解析：保留所有完整的三元组和块，只对失败的字段重新提问
+        triplets, chunks, failed_keys = parse_extraction_output(content)
+        if failed_keys:
+            _quarantine(source_id, current_hash, content, list(failed_keys))
+            triplets, chunks, failed_keys = _repair_failed_keys(client, prompt, source_id, triplets, chunks, failed_keys)
+
+        if failed_keys and not triplets and not chunks:
+            logger.error(f"❌ JSON 解析失败，未能抢救出任何数据 (Source: {source_id})")
+            return [], [], ""
+
+    # ================= Embedding 补全逻辑 =================
+    embeddings_added = _complete_embeddings(chunks)
+    # ===================================================
+
+    if failed_keys:
+        # 不完整的结果不写缓存，避免坏数据被永久复用
+        logger.warning(f"⚠️ 仅抢救出部分结果 (缺失字段: {failed_keys})，本次不写入缓存。")
+        current_hash += PARTIAL_HASH_SUFFIX
+    elif cached is None or embeddings_added:
+        # 缓存中保存的是解析后的完整 JSON 对象，而不是 LLM 原始返回的字符串
+        if _write_cache(cache_file, {"triplets": triplets, "chunks": chunks}):
+            logger.info(f"💾 提取结果已保存至缓存: {cache_file}")
+
+    token_info = " (Cached)" if cached is not None else ""
+    logger.info(f"✅ 提取成功: {len(triplets)} 个三元组, {len(chunks)} 个块。{token_info}")
+
+    return triplets, chunks, current_hash
+
+def pack_notes(notes, prompt_template, token_budget=None, max_notes=None, small_note_tokens=None):
+    """
+    按 token 预算把短笔记装箱，返回 List[List[note]]
+    - 超过 small_note_tokens 的长笔记单独成组 (走单篇提取)
+    - 每组笔记 token 之和 + 模板开销 不超过 token_budget
+    :param notes: List[Dict] {"source_id": ..., "content": ...}
+    """
+    token_budget = token_budget or settings.EXTRACTION_BATCH_TOKEN_BUDGET
+    max_notes = max_notes or settings.EXTRACTION_BATCH_MAX_NOTES
+    small_note_tokens = small_note_tokens or settings.EXTRACTION_BATCH_SMALL_NOTE_TOKENS
+
+    overhead = estimate_tokens(prompt_template) + estimate_tokens(BATCH_INSTRUCTION)
+    groups = []
+    current, current_tokens = [], overhead
+
+    for note in notes:
+        # 分隔符本身也占 token
+        note_tokens = estimate_tokens(note["content"]) + 2 * estimate_tokens(BATCH_NOTE_START.format(source_id=note["source_id"]))
+
+        if note_tokens > small_note_tokens:
+            groups.append([note])
+            continue
+
+        if current and (current_tokens + note_tokens > token_budget or len(current) >= max_notes):
+            groups.append(current)
+            current, current_tokens = [], overhead
+
+        current.append(note)
+        current_tokens += note_tokens
+
+    if current:
+        groups.append(current)
+    return groups
+
+def build_batch_prompt(notes, prompt_template):
+    """把多篇笔记用分隔符拼接后填入模板"""
+    parts = [BATCH_INSTRUCTION.format(count=len(notes))]
+    for note in notes:
+        parts.append(BATCH_NOTE_START.format(source_id=note["source_id"]))
+        parts.append(note["content"])
+        parts.append(BATCH_NOTE_END.format(source_id=note["source_id"]))
+    return build_prompt("\n".join(parts), prompt_template)
 
+def _load_cached_data(cache_file, source_id, prompt_hash):
+    """
+    读取并解析单篇缓存，返回 (triplets, chunks)，没有缓存返回 None
+    缓存内容损坏时将其隔离并删除，避免坏缓存被反复读取
+    """
+    if not os.path.exists(cache_file):
+        return None
+    try:
+        with open(cache_file, 'r', encoding='utf-8') as f:
+            content = f.read()
+    except Exception as e:
+        logger.error(f"读取缓存文件失败: {e}，准备重新调用 API。")
+        return None
+
+    triplets, chunks, failed_keys = parse_extraction_output(content)
+    if not failed_keys:
+        if _attach_embeddings(cache_file, chunks):
+            # 旧版缓存把向量以 JSON 数字存储，顺便转换为紧凑格式
+            _write_cache(cache_file, {"triplets": triplets, "chunks": chunks})
+        return triplets, chunks
+
+    logger.warning(f"⚠️ 缓存内容损坏，删除后重新调用 API: {os.path.basename(cache_file)}")
+    _quarantine(source_id, prompt_hash, content, failed_keys)
     try:
-        # 清洗 JSON
-        cleaned_content = content
-        if cleaned_content.startswith("```"):
-            cleaned_content = cleaned_content.replace("```json", "").replace("```", "")
-        
-        data = json.loads(cleaned_content)
-        
-        triplets = data.get("triplets", [])
-        chunks = data.get("chunks", [])
-
-        # ================= Embedding 补全逻 =================
-        # 检查 chunks 中是否缺失 embedding
-        missing_embeddings_indices = []
-        texts_to_embed = []
-
-        for i, chunk in enumerate(chunks):
-            if "embedding" not in chunk or not chunk["embedding"]:
-                missing_embeddings_indices.append(i)
-                texts_to_embed.append(chunk["content"])
-
-        if texts_to_embed:
-            logger.info(f"🧩 检测到 {len(texts_to_embed)} 个文本块缺失 Embedding (共 {len(chunks)} 个)，正在补全...")
-            
-            embeddings = get_embeddings_batch(texts_to_embed)
-            
-            # 填回 chunks
-            for idx, emb in zip(missing_embeddings_indices, embeddings):
-                chunks[idx]["embedding"] = emb
-            
-            # 更新 data 对象
-            data["chunks"] = chunks
-            
-            # 回写缓存 (覆盖旧文件)
+        os.remove(cache_file)
+    except OSError as e:
+        logger.warning(f"无法删除损坏的缓存 {cache_file}: {e}")
+    return None
+
+@profiled("extract_hybrid_data_batch")
+def extract_hybrid_data_batch(notes, prompt_template, token_budget=None):
+    """
+    批量模式：把多篇短笔记装进同一次 LLM 调用，按 source_id 拆回每篇的三元组和块
+    缓存仍按单篇 Prompt 的 hash 存储，与 extract_hybrid_data 互通
+    :param notes: List[Dict] {"source_id": ..., "content": ...}
+    :return: Dict[source_id, (triplets, chunks, current_hash)]
+    """
+    results = {}
+    pending = []
+
+    # 1. 先逐篇查缓存，命中的直接返回
+    for note in notes:
+        source_id = note["source_id"]
+        prompt = build_prompt(note["content"], prompt_template)
+        prompt_hash = compute_prompt_hash(prompt)
+        cache_file = get_cache_path(prompt, source_id)
+        cached = _load_cached_data(cache_file, source_id, prompt_hash)
+
+        if cached is None:
+            pending.append({**note, "prompt_hash": prompt_hash, "cache_file": cache_file})
+            continue
+
+        logger.info(f"📦 [{source_id}] 已在 storage 中找到缓存，跳过 API 调用。")
+        triplets, chunks = cached
+        # 向量补全失败只影响这一篇笔记，不能中断整个批次
+        try:
+            if _complete_embeddings(chunks):
+                _write_cache(cache_file, {"triplets": triplets, "chunks": chunks})
+        except Exception as e:
+            logger.error(f"❌ [{source_id}] 补全 Embedding 失败: {e}")
+            results[source_id] = ([], [], "")
+            continue
+        results[source_id] = (triplets, chunks, prompt_hash)
+
+    if not pending:
+        return results
+
+    client = get_openai_client()
+    groups = pack_notes(pending, prompt_template, token_budget=token_budget)
+    logger.info(f"📦 批量提取: {len(pending)} 篇未缓存笔记被装入 {len(groups)} 次请求")
+
+    for group in groups:
+        # 单篇成组的笔记直接走原有流程
+        if len(group) == 1:
+            note = group[0]
+            results[note["source_id"]] = extract_hybrid_data(note["content"], prompt_template, source_id=note["source_id"])
+            continue
+
+        source_ids = [note["source_id"] for note in group]
+        logger.info("="*15 + f" 批量分析 {len(group)} 篇笔记 {source_ids} " + "="*15)
+
+        batch_prompt = build_batch_prompt(group, prompt_template)
+        _log_text("📤 [Request] 批量请求内容:", batch_prompt)
+
+        try:
+            content = _call_llm(client, batch_prompt)
+        except Exception as e:
+            logger.error(f"❌ 批量提取失败，将逐篇重试: {e}")
+            content = ""
+        _log_text("📥 [Response] 批量返回内容:", content)
+
+        # 容错解析：被截断或损坏的笔记只对其本身重新提问
+        batch_data, complete, incomplete_ids = parse_json_lenient(content)
+        if content and not complete:
+            _quarantine("batch", compute_prompt_hash(batch_prompt), content, incomplete_ids)
+
+        # 2. 按 source_id 拆分，写入各自的缓存
+        for note in group:
+            source_id = note["source_id"]
+            note_data = batch_data.get(source_id)
+
+            if not isinstance(note_data, dict) or source_id in incomplete_ids:
+                logger.warning(f"⚠️ 批量结果中 [{source_id}] 缺失或不完整，改为单篇提取")
+                results[source_id] = extract_hybrid_data(note["content"], prompt_template, source_id=source_id)
+                continue
+
             try:
-                # 注意：这里我们覆盖写入的是完整的 JSON 对象，不再是 LLM 原始返回的所谓 Markdown 字符串
-                # 为了保持通过 "content" 变量的一致性，虽然稍微改变了存储格式(纯JSON vs Markdown包裹)，
-                # 但下一次读取时 json.loads 依然能解析纯 JSON
-                with open(cache_file, 'w', encoding='utf-8') as f:
-                    json.dump(data, f, ensure_ascii=False, indent=2)
-                logger.info(f"💾 Embedding 已补全并更新缓存: {cache_file}")
+                triplets, chunks = validate_extraction(note_data)
+                _complete_embeddings(chunks)
             except Exception as e:
-                logger.error(f"❌ 缓存回写失败: {e}")
-        else:
-            logger.info(f"⏩ 所有文本块均包含 Embedding，跳过向量计算。")
-        # ===================================================
-        
-        token_info = " (Cached)" if is_cached else ""
-        logger.info(f"✅ 提取成功: {len(triplets)} 个三元组, {len(chunks)} 个块。{token_info}")
-        
-        # 返回 hash_md5 方便上层做版本控制
-        # 注意：这里的 content 是 API 返回的内容，不是原始笔记内容的 hash。
-        # 我们应该返回原始笔记 prompt 的 hash，即生成 cache_file 时用的 hash。
-        # 上面 get_cache_path 里算过一次，但没有返回。
-        # 我们重新计算一次或者让 get_cache_path 返回。
-        # 简单起见，重新计算 prompt 的 hash (它包含了原始文本)
-        current_hash = hashlib.md5(prompt.encode('utf-8')).hexdigest()
-        
-        return triplets, chunks, current_hash
+                logger.error(f"❌ [{source_id}] 处理批量结果失败: {e}")
+                results[source_id] = ([], [], "")
+                continue
 
-    except Exception as e:
-        logger.error(f"❌ JSON 解析出错: {str(e)}", exc_info=True)
-        return [], [], ""
+            if _write_cache(note["cache_file"], {"triplets": triplets, "chunks": chunks}):
+                logger.info(f"💾 [{source_id}] 批量结果已拆分保存至缓存")
+
+            logger.info(f"✅ [{source_id}] 提取成功: {len(triplets)} 个三元组, {len(chunks)} 个块。(Batch)")
+            results[source_id] = (triplets, chunks, note["prompt_hash"])
+
+    return results
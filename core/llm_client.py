@@ -0,0 +1,17 @@
+import logging
+from config import settings
+
+logger = logging.getLogger(__name__)
+
+_client = None
+
+def get_openai_client():
+    """
+    获取 OpenAI 兼容客户端 (LLM 与 Embedding 共用)
+    openai SDK 导入较慢，首次使用时才导入，并在进程内复用同一个客户端与连接池
+    """
+    global _client
+    if _client is None:
+        from openai import OpenAI
+        _client = OpenAI(api_key=settings.API_KEY, base_url=settings.BASE_URL)
+    return _client
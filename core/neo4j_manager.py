@@ -1,221 +1,1041 @@
+import hashlib
 import logging
-from neo4j import GraphDatabase
+import re
+import time
 from config import settings
+from core.embedding import as_driver_list, reduce_embedding, embedding_version, version_slug
+from core.profiler import get_active_profiler
 
 logger = logging.getLogger(__name__)
 
+# schema 版本号：修改 create_constraints 中的约束/索引时需要递增
+# 数据库中用 (:SchemaVersion {id: 'graphrag'}) 节点记录已应用的版本，版本一致时跳过 schema 语句
+SCHEMA_VERSION = 6
+SCHEMA_MARKER_ID = "graphrag"
+
+# 全精度向量索引 (vector_storage.mode = full) 与降维向量索引 (mode = reduced)
+# 这里是第一个 embedding 版本使用的名字，之后登记的版本带版本后缀，见 make_embedding_layout
+CHUNK_VECTOR_INDEX = "chunk_embedding_index"
+CHUNK_REDUCED_VECTOR_INDEX = "chunk_embedding_reduced_index"
+# 社区摘要的向量索引 (全局问题检索)
+COMMUNITY_VECTOR_INDEX = "community_summary_index"
+
+# embedding 版本的状态：active 服务查询；building 正在补全 (入库时同时写入)；retired 已被替换，不再写入
+EMBEDDING_ACTIVE = "active"
+EMBEDDING_BUILDING = "building"
+EMBEDDING_RETIRED = "retired"
+# 可以写入 embedding 的节点标签 -> 用于生成向量的文本属性
+EMBEDDING_LABELS = {"Chunk": "content", "Community": "summary"}
+
+# graph.relation_schema = fixed 时只使用这两种关系类型，原始谓词保存在 predicate 属性上
+RELATION_TYPE = "RELATES"   # Concept -> Concept
+MENTION_TYPE = "MENTIONS"   # Concept -> Chunk
+
+_WHITESPACE = re.compile(r"\s+")
+
+def make_relation_type(predicate, default):
+    """dynamic 模式下把自由文本谓词转换为关系类型名 (空白替换为下划线并大写)"""
+    return "_".join((predicate or "").split()).upper() or default
+
+def make_chunk_id(source_id, content):
+    """
+    Chunk 的稳定 id：来源 + 内容 (空白规范化后) 的 hash
+    同一来源重复写入同一段文本时 MERGE 到同一个节点，不会产生重复
+    """
+    normalized = _WHITESPACE.sub(" ", content or "").strip()
+    return hashlib.sha1(f"{source_id}\n{normalized}".encode('utf-8')).hexdigest()
+
+def make_embedding_layout(version, model, dim, legacy=False):
+    """
+    一个 embedding 版本在库中的存储位置：向量属性名和向量索引名
+    - legacy: 第一个登记的版本沿用引入版本管理之前的 c.embedding 和原有索引名，已有数据无需迁移
+    - 其他版本使用带版本后缀的属性和索引，与旧版本并存，互不影响
+    """
+    if legacy:
+        names = ("embedding", "embedding_reduced", CHUNK_VECTOR_INDEX, CHUNK_REDUCED_VECTOR_INDEX, COMMUNITY_VECTOR_INDEX)
+    else:
+        slug = version_slug(version)
+        names = (f"embedding_{slug}", f"embedding_{slug}_reduced", f"chunk_embedding_{slug}_index",
+                 f"chunk_embedding_{slug}_reduced_index", f"community_summary_{slug}_index")
+    keys = ("property", "reduced_property", "index", "reduced_index", "community_index")
+    return {"id": version, "model": model, "dim": dim, **dict(zip(keys, names))}
+
 class Neo4jManager:
-    def __init__(self):
+    # 同一进程内 schema 只检查一次
+    _schema_ready = False
+
+    def __init__(self, verify_connectivity=True):
         self.driver = None
-        self.connect()
+        # embedding 版本登记表的缓存 (查询和入库的热路径上不每次都访问数据库)
+        self._embedding_versions = None
+        self._embedding_versions_at = 0.0
+        self._bookmarks = None
+        self.connect(verify_connectivity)
 
-    def connect(self):
-        """连接到 Neo4j 数据库并初始化约束"""
+    def connect(self, verify_connectivity=True):
+        """
+        连接到 Neo4j 数据库
+        schema 不在这里初始化，而是在第一次写入前由 ensure_schema 按版本号按需执行
+        :param verify_connectivity: 是否立即验证连通性 (短生命周期的查询进程可以跳过)
+        """
         try:
+            from neo4j import GraphDatabase  # neo4j 驱动导入较慢，真正连接时才导入
+
+            # 连接池与重试参数见 config.yaml 的 neo4j 段
+            # URI 使用 neo4j:// (而不是 bolt://) 时驱动会启用路由，读事务分发到集群的 follower / 只读副本
             self.driver = GraphDatabase.driver(
                 settings.NEO4J_URI, 
-                auth=(settings.NEO4J_USER, settings.NEO4J_PASSWORD)
+                auth=(settings.NEO4J_USER, settings.NEO4J_PASSWORD),
+                max_connection_pool_size=settings.NEO4J_MAX_POOL_SIZE,
+                connection_acquisition_timeout=settings.NEO4J_ACQUISITION_TIMEOUT,
+                connection_timeout=settings.NEO4J_CONNECTION_TIMEOUT,
+                max_transaction_retry_time=settings.NEO4J_MAX_RETRY_TIME
             )
+            # 所有会话共享同一个书签管理器 (因果一致性)：读事务被路由到 follower / 只读副本时，
+            # 也能看到本进程之前提交的写入 (例如写完笔记后立即读取概念图、版本号)
+            self._bookmarks = GraphDatabase.bookmark_manager()
             
-            self.driver.verify_connectivity()
-            logger.info("✅ Neo4j 连接成功！")
-            
-            self.create_constraints()
+            if verify_connectivity:
+                self.driver.verify_connectivity()
+                logger.info("✅ Neo4j 连接成功！")
             
         except Exception as e:
             logger.error(f"❌ Neo4j 连接失败: {e}")
             self.driver = None
 
+    def _session(self, **kwargs):
+        """打开一个会话 (统一指定数据库名、fetch_size 和共享的书签管理器)"""
+        return self.driver.session(database=settings.NEO4J_DATABASE, fetch_size=settings.NEO4J_FETCH_SIZE,
+                                   bookmark_manager=self._bookmarks, **kwargs)
+
+    def run_read(self, cypher, **params):
+        """
+        在托管的读事务中执行查询 (session.execute_read)：
+        遇到瞬时错误 (死锁、leader 切换、连接中断等) 时由驱动自动重试，集群中会被路由到可读的成员
+        :return: List[Dict]；重试后仍失败时抛出异常
+        """
+        profiles = []
+
+        def work(tx):
+            # 事务函数在重试时会被重新执行，只保留最后一次 (成功的) 尝试的 PROFILE 结果
+            profiles.clear()
+            return self._run_in_tx(tx, cypher, params, profiles)
+
+        with self._session() as session:
+            records = session.execute_read(work)
+        self._record_profiles(profiles)
+        return records
+
+    def run_write(self, cypher, **params):
+        """在托管的写事务中执行单条语句，返回结果记录；瞬时错误自动重试"""
+        return self.run_write_batch([(cypher, params)])[0]
+
+    def run_write_batch(self, statements):
+        """
+        在同一个托管写事务中依次执行多条语句，要么全部提交，要么全部回滚
+        事务函数可能被重试多次，因此语句本身必须是幂等的 (MERGE / DELETE)
+        :param statements: List[(cypher, params)]
+        :return: 每条语句的结果记录 List[List[Dict]]
+        """
+        profiles = []
+
+        def work(tx):
+            profiles.clear()
+            return [self._run_in_tx(tx, cypher, params, profiles) for cypher, params in statements]
+
+        with self._session() as session:
+            results = session.execute_write(work)
+        self._record_profiles(profiles)
+        return results
+
+    @staticmethod
+    def _run_in_tx(tx, cypher, params, profiles):
+        """
+        在事务中执行一条语句；开启 --profile 时加上 PROFILE 前缀，并把 db hits 和执行计划暂存到 profiles
+        (事务提交后才由 _record_profiles 记录，重试失败的尝试不计入)
+        """
+        if get_active_profiler() is None:
+            return [record.data() for record in tx.run(cypher, **params)]
+
+        started = time.perf_counter()
+        result = tx.run("PROFILE " + cypher.lstrip(), **params)
+        records = [record.data() for record in result]
+        profiles.append((cypher, result.consume(), time.perf_counter() - started))
+        return records
+
+    @staticmethod
+    def _record_profiles(profiles):
+        profiler = get_active_profiler()
+        if profiler is None:
+            return
+        for cypher, summary, seconds in profiles:
+            profiler.record_query(cypher, summary, seconds)
+
+    def _vector_index_config(self):
+        """
+        当前配置下向量索引的形态 (模式 / 降维维度 / 是否量化)，变化时需要重建向量索引
+        模型维度不在这里：换模型或维度会登记一个新的 embedding 版本，使用独立的索引
+        """
+        dim = settings.VECTOR_REDUCED_DIM if settings.VECTOR_STORAGE_MODE == "reduced" else "full"
+        return f"{settings.VECTOR_STORAGE_MODE}:{dim}:q{int(settings.VECTOR_QUANTIZATION)}"
+
+    @staticmethod
+    def _normalize_vector_config(config):
+        """旧版本在 full 模式下把模型维度也记在形态里 (full:1024:q0)，比较时忽略，避免升级后无谓地重建索引"""
+        parts = (config or "").split(":")
+        if len(parts) == 3 and parts[0] == "full":
+            parts[1] = "full"
+        return ":".join(parts)
+
+    def _expected_schema_version(self):
+        """向量索引的形态、关系的存储方式和配置的 embedding 版本也是 schema 的一部分，变化时需要重新执行"""
+        return f"{SCHEMA_VERSION}:{self._vector_index_config()}:{settings.GRAPH_RELATION_SCHEMA}:{embedding_version()}"
+
+    def ensure_schema(self):
+        """
+        按需初始化 schema：数据库中的版本标记与当前版本一致时直接跳过
+        只有首次部署或 schema 变化时才真正执行 create_constraints
+        """
+        if not self.driver or Neo4jManager._schema_ready:
+            return
+
+        expected = self._expected_schema_version()
+        try:
+            records = self.run_read(
+                "MATCH (v:SchemaVersion {id: $id}) RETURN v.version AS version, v.vector_config AS vector_config, v.relation_schema AS relation_schema",
+                id=SCHEMA_MARKER_ID
+            )
+            record = records[0] if records else None
+
+            if record and record["version"] == expected:
+                Neo4jManager._schema_ready = True
+                return
+
+            logger.info(f"⚡ schema 版本变化 ({record['version'] if record else 'None'} -> {expected})，开始初始化...")
+            # 向量索引的维度/量化选项无法原地修改，形态变化时需要删除后重建
+            vector_config = self._vector_index_config()
+            rebuild = bool(record and record["vector_config"] and self._normalize_vector_config(record["vector_config"]) != vector_config)
+            # 关系存储方式切换时，把已有的关系迁移到新的形式
+            # 没有标记 (旧代码建的库) 或标记里没有 relation_schema 时，已有的关系都是按谓词建的类型 (dynamic)
+            previous_relation_schema = (record["relation_schema"] if record else None) or "dynamic"
+            migrate = previous_relation_schema != settings.GRAPH_RELATION_SCHEMA
+            # 配置的 embedding 模型/维度变化时登记新版本 (新版本的索引在 create_constraints 中创建)
+            self._register_embedding_version(record["vector_config"] if record else None)
+            if self.create_constraints(rebuild_vector_index=rebuild) and (not migrate or self.migrate_relation_schema()):
+                self.run_write(
+                    """
+                    MERGE (v:SchemaVersion {id: $id})
+                    SET v.version = $version, v.vector_config = $vector_config,
+                        v.relation_schema = $relation_schema, v.updated_at = datetime()
+                    """,
+                    id=SCHEMA_MARKER_ID, version=expected, vector_config=vector_config,
+                    relation_schema=settings.GRAPH_RELATION_SCHEMA
+                )
+                Neo4jManager._schema_ready = True
+        except Exception as e:
+            logger.error(f"❌ 检查 schema 版本失败: {e}")
+
     def close(self):
         """关闭驱动连接"""
         if self.driver:
             self.driver.close()
 
-    def create_constraints(self):
-        """创建唯一性约束和索引，保证Concept节点的name属性唯一，Chunk节点的content属性唯一"""
+    def create_constraints(self, rebuild_vector_index=False):
+        """
+        创建唯一性约束和索引，保证Concept节点的name属性唯一，Chunk节点的id (内容 hash) 唯一
+        :param rebuild_vector_index: 向量索引的维度/量化配置变化时，先删除旧的向量索引
+        :return: 是否执行成功 (成功后才会写入 schema 版本标记)
+        """
         if not self.driver:
-            return
+            return False
         
         try:
-            with self.driver.session() as session:
+            # schema 语句和 CALL {} IN TRANSACTIONS 只能在自动提交事务中执行
+            with self._session() as session:
                 # 针对 Concept 创建约束 
                 session.run("CREATE CONSTRAINT constraint_concept_name IF NOT EXISTS FOR (c:Concept) REQUIRE c.name IS UNIQUE")
                 
-                # 针对 Chunk 创建索引
-                session.run("CREATE INDEX index_chunk_content IF NOT EXISTS FOR (c:Chunk) ON (c.content)")
+                # 针对 Chunk 的内容 hash 创建约束 (自带索引，用于 MERGE)
+                session.run("CREATE CONSTRAINT constraint_chunk_id IF NOT EXISTS FOR (c:Chunk) REQUIRE c.id IS UNIQUE")
+
+                # 按来源清理旧数据时使用
+                session.run("CREATE INDEX index_chunk_source IF NOT EXISTS FOR (c:Chunk) ON (c.source)")
+
+                # 查询端的概念链接按创建时间增量拉取新概念
+                session.run("CREATE INDEX index_concept_created_at IF NOT EXISTS FOR (c:Concept) ON (c.created_at)")
+
+                # fixed 模式下按谓词过滤、按来源清理关系时使用的关系属性索引
+                session.run(f"CREATE INDEX index_relates_predicate IF NOT EXISTS FOR ()-[r:{RELATION_TYPE}]-() ON (r.predicate)")
+                session.run(f"CREATE INDEX index_relates_source IF NOT EXISTS FOR ()-[r:{RELATION_TYPE}]-() ON (r.source)")
+                session.run(f"CREATE INDEX index_mentions_predicate IF NOT EXISTS FOR ()-[r:{MENTION_TYPE}]-() ON (r.predicate)")
+
+                # 社区节点按 id 增量更新
+                session.run("CREATE CONSTRAINT constraint_community_id IF NOT EXISTS FOR (c:Community) REQUIRE c.id IS UNIQUE")
+
+                # 旧版本在完整的 content 文本上建的 B-tree 索引体积大、维护慢，已由 id 约束替代
+                session.run("DROP INDEX index_chunk_content IF EXISTS")
 
-                # 创建向量索引 (针对 Chunk 的 embedding 属性)
+                # 创建向量索引 (每个 embedding 版本各有一组索引)
                 # 注意: Neo4j 5.x 语法
+                # 失败时不写入 schema 版本标记，下次连接时重试，避免向量索引缺失却被当作已完成
                 try:
-                    # 检查索引是否存在 (简单检查，防止重复创建报错)
-                    # 这里的维度必须与 settings.EMBEDDING_DIM 一致
-                    vector_index_query = f"""
-                    CREATE VECTOR INDEX chunk_embedding_index IF NOT EXISTS
-                    FOR (c:Chunk) ON (c.embedding)
-                    OPTIONS {{indexConfig: {{
-                        `vector.dimensions`: {settings.EMBEDDING_DIM},
-                        `vector.similarity_function`: 'cosine'
-                    }}}}
-                    """
-                    session.run(vector_index_query)
+                    self._create_vector_index(session, rebuild_vector_index)
                     logger.info("⚡ 向量索引 check/create 完成")
                 except Exception as e:
-                    logger.warning(f"⚠️ 创建向量索引时遇到问题 (如果是旧版本 Neo4j 请忽略): {e}")
+                    logger.warning(f"⚠️ 创建向量索引时遇到问题，下次连接时重试: {e}")
+                    return False
             
             logger.info("⚡ Neo4j 索引/约束检查完毕")
+            return True
         except Exception as e:
             logger.info(f"ℹ️ 尝试创建索引/约束: {e}")
+            return False
+
+    def _create_vector_index(self, session, rebuild=False):
+        """为每个仍在使用的 embedding 版本 (active / building) 创建向量索引，已退役的版本不再维护"""
+        for version in self._read_embedding_versions():
+            if version["status"] != EMBEDDING_RETIRED:
+                self._create_version_index(session, version, rebuild)
+
+    @staticmethod
+    def _vector_index_dimensions(session):
+        """已存在的向量索引 Dict[索引名, 维度]"""
+        records = session.run("SHOW VECTOR INDEXES YIELD name, options RETURN name, options")
+        return {
+            record["name"]: (record["options"] or {}).get("indexConfig", {}).get("vector.dimensions")
+            for record in records
+        }
+
+    @staticmethod
+    def _supports_vector_quantization(session):
+        """Neo4j 5.23 起向量索引才支持 vector.quantization.enabled，更早的版本会拒绝这个选项"""
+        try:
+            versions = [record["version"] for record in session.run(
+                "CALL dbms.components() YIELD name, versions WHERE name = 'Neo4j Kernel' RETURN versions[0] AS version"
+            )]
+            major, minor = (int(part) for part in re.findall(r"\d+", versions[0])[:2])
+        except Exception as e:
+            logger.warning(f"⚠️ 无法识别 Neo4j 版本，创建向量索引时不设置量化选项: {e}")
+            return False
+        return (major, minor) >= (5, 23)
+
+    def _create_version_index(self, session, version, rebuild=False):
+        """
+        按 vector_storage 配置为一个 embedding 版本创建向量索引，同一时间只保留一个：
+        - full: 在全精度的向量属性上建索引
+        - reduced: 在截断到 reduced_dim 维的向量属性上建索引，
+          全精度向量仍作为普通属性保存，只在查询时用于重排，不再占用向量索引的内存
+        quantization 开启时使用 Neo4j 内置的量化索引 (Neo4j 5.23+)
+        索引维度取自版本本身，不同模型/维度的向量不会混进同一个索引
+        """
+        if rebuild:
+            session.run(f"DROP INDEX {version['index']} IF EXISTS")
+            session.run(f"DROP INDEX {version['reduced_index']} IF EXISTS")
+
+        full_prop, reduced_prop = version["property"], version["reduced_property"]
+        if settings.VECTOR_STORAGE_MODE == "reduced":
+            # 已有的 Chunk 直接在库内截断补全 (余弦相似度与向量长度无关，截断即可)
+            # reduced_dim 变化后，按旧维度截断的向量也要重新截断，否则会从重建的索引中消失
+            session.run(f"""
+            MATCH (c:Chunk) WHERE c.`{full_prop}` IS NOT NULL
+              AND (c.`{reduced_prop}` IS NULL OR size(c.`{reduced_prop}`) <> $dim)
+            CALL {{ WITH c SET c.`{reduced_prop}` = c.`{full_prop}`[0..$dim] }} IN TRANSACTIONS OF 1000 ROWS
+            """, dim=settings.VECTOR_REDUCED_DIM)
+            session.run(f"DROP INDEX {version['index']} IF EXISTS")
+            index_name, prop, dim = version["reduced_index"], reduced_prop, settings.VECTOR_REDUCED_DIM
+        else:
+            session.run(f"DROP INDEX {version['reduced_index']} IF EXISTS")
+            index_name, prop, dim = version["index"], full_prop, version["dim"]
+
+        # CREATE ... IF NOT EXISTS 不会修改已有索引：维度不符的索引 (例如旧代码按别的维度建的) 先删除再重建
+        existing = self._vector_index_dimensions(session)
+        for name, expected in ((index_name, dim), (version["community_index"], version["dim"])):
+            if existing.get(name) is not None and existing[name] != expected:
+                logger.warning(f"⚠️ 向量索引 {name} 的维度 ({existing[name]}) 与 {expected} 不符，删除后重建")
+                session.run(f"DROP INDEX {name} IF EXISTS")
+
+        # Neo4j 5.23+ 默认开启量化，关闭时也必须显式写 false；更早的版本不认识这个选项，也没有量化索引
+        quantization = ""
+        if self._supports_vector_quantization(session):
+            quantization = f",\n            `vector.quantization.enabled`: {'true' if settings.VECTOR_QUANTIZATION else 'false'}"
+        elif settings.VECTOR_QUANTIZATION:
+            logger.warning("⚠️ 当前 Neo4j 版本 (< 5.23) 不支持量化向量索引，使用全精度索引")
+        session.run(f"""
+        CREATE VECTOR INDEX {index_name} IF NOT EXISTS
+        FOR (c:Chunk) ON (c.`{prop}`)
+        OPTIONS {{indexConfig: {{
+            `vector.dimensions`: {dim},
+            `vector.similarity_function`: 'cosine'{quantization}
+        }}}}
+        """)
+
+        # 社区摘要数量很少，始终使用全精度向量
+        session.run(f"""
+        CREATE VECTOR INDEX {version['community_index']} IF NOT EXISTS
+        FOR (c:Community) ON (c.`{full_prop}`)
+        OPTIONS {{indexConfig: {{
+            `vector.dimensions`: {version['dim']},
+            `vector.similarity_function`: 'cosine'
+        }}}}
+        """)
+
+    # ================= embedding 版本 =================
+    def _read_embedding_versions(self):
+        """从数据库读取全部 embedding 版本 (失败时抛出异常)"""
+        records = self.run_read("""
+        MATCH (v:EmbeddingVersion)
+        RETURN v.id AS id, v.model AS model, v.dim AS dim, v.status AS status,
+               v.property AS property, v.reduced_property AS reduced_property,
+               v.index AS index, v.reduced_index AS reduced_index, v.community_index AS community_index
+        ORDER BY v.created_at
+        """)
+        self._embedding_versions = records
+        self._embedding_versions_at = time.monotonic()
+        return records
+
+    def get_embedding_versions(self, max_age=None):
+        """
+        读取 embedding 版本登记表，距上次读取不足 max_age 秒 (默认 refresh_interval) 时直接返回缓存
+        另一个进程 (--reembed) 切换生效版本后，最迟 refresh_interval 秒内生效
+        """
+        max_age = settings.EMBEDDING_VERSION_REFRESH_INTERVAL if max_age is None else max_age
+        if self._embedding_versions is not None and time.monotonic() - self._embedding_versions_at < max_age:
+            return self._embedding_versions
+        if not self.driver:
+            return self._embedding_versions or []
+        try:
+            return self._read_embedding_versions()
+        except Exception as e:
+            logger.error(f"❌ 读取 embedding 版本失败: {e}")
+            return self._embedding_versions or []
+
+    def _default_embedding_version(self):
+        """登记表为空 (尚未写入过数据) 时，当前配置的模型就是生效版本，使用原有的属性和索引"""
+        layout = make_embedding_layout(embedding_version(), settings.EMBEDDING_MODEL, settings.EMBEDDING_DIM, legacy=True)
+        return {**layout, "status": EMBEDDING_ACTIVE}
+
+    def get_active_embedding_version(self):
+        """查询使用的 embedding 版本 (模型、维度、向量属性和索引名)"""
+        for version in self.get_embedding_versions():
+            if version["status"] == EMBEDDING_ACTIVE:
+                return version
+        return self._default_embedding_version()
+
+    def get_embedding_targets(self):
+        """写入时需要填充的 embedding 版本：生效版本 + 正在补全的版本"""
+        targets = [version for version in self.get_embedding_versions() if version["status"] != EMBEDDING_RETIRED]
+        return targets or [self._default_embedding_version()]
+
+    def _detect_legacy_embedding(self, previous_vector_config=None):
+        """
+        登记表为空但库中已有向量 (从引入版本管理之前的代码升级) 时，推断这些向量实际的模型和维度
+        - 维度：以已存储的 c.embedding 长度为准，其次是旧 schema 标记中 full 模式记录的维度
+        - 模型：旧数据没有记录模型，只能由 embedding_migration.legacy_model 声明
+        :return: (model, dim)；库中没有向量时返回 None
+        :raises RuntimeError: 库中有向量但没有声明模型 (来源不明的向量不予登记，schema 标记不会写入，下次连接时重新检查)
+        """
+        records = self.run_read("MATCH (c:Chunk) WHERE c.embedding IS NOT NULL RETURN size(c.embedding) AS dim LIMIT 1")
+        dim = records[0]["dim"] if records else None
+        parts = (previous_vector_config or "").split(":")
+        if dim is None and len(parts) == 3 and parts[0] == "full" and parts[1].isdigit():
+            dim = int(parts[1])
+        if dim is None:
+            return None
+
+        model = settings.EMBEDDING_MIGRATION_LEGACY_MODEL
+        if not model:
+            raise RuntimeError(
+                f"库中已有 {dim} 维的旧向量，但无法确定生成它们的模型；请在 config.yaml 的 "
+                f"embedding_migration.legacy_model 中填写该模型名 (未换过模型就填 {settings.EMBEDDING_MODEL})"
+            )
+        return model, dim
+
+    def _write_embedding_version(self, layout, status):
+        self.run_write("""
+        MERGE (v:EmbeddingVersion {id: $id})
+        ON CREATE SET v.created_at = datetime()
+        SET v += $layout, v.status = $status
+        """, id=layout["id"], layout=layout, status=status)
+        self._embedding_versions = None
+
+    def _register_embedding_version(self, previous_vector_config=None):
+        """
+        登记当前配置的 embedding 版本 (在 ensure_schema 中调用)：
+        - 登记表为空：库中已有的 c.embedding 按实际存储的维度和声明的旧模型登记为生效版本，沿用原有索引；
+          空库时当前配置直接作为生效版本
+        - 新的模型/维度：登记为 building，入库时同时写入新旧两个版本，由 --reembed 补全历史数据后切换
+        - 配置改回了生效版本：放弃尚未完成的迁移
+        """
+        versions = {version["id"]: version for version in self._read_embedding_versions()}
+        configured = embedding_version()
+
+        if not versions:
+            legacy = self._detect_legacy_embedding(previous_vector_config)
+            if legacy:
+                layout = make_embedding_layout(embedding_version(*legacy), *legacy, legacy=True)
+                self._write_embedding_version(layout, EMBEDDING_ACTIVE)
+                versions[layout["id"]] = {**layout, "status": EMBEDDING_ACTIVE}
+                logger.info(f"ℹ️ 已有向量登记为 embedding 版本 {layout['id']}")
+
+        current = versions.get(configured)
+        if current and current["status"] == EMBEDDING_ACTIVE:
+            abandoned = [vid for vid, version in versions.items() if version["status"] == EMBEDDING_BUILDING]
+            if abandoned:
+                logger.info(f"ℹ️ 配置已改回生效的 embedding 版本 {configured}，放弃未完成的迁移: {abandoned}")
+                self._set_embedding_status(abandoned, EMBEDDING_RETIRED)
+            return
+        if current and current["status"] == EMBEDDING_BUILDING:
+            return
+
+        status = EMBEDDING_BUILDING if versions else EMBEDDING_ACTIVE
+        layout = make_embedding_layout(configured, settings.EMBEDDING_MODEL, settings.EMBEDDING_DIM, legacy=not versions)
+        if current:
+            # 退役过的版本重新启用：沿用原来的属性和索引名，缺失的向量由 --reembed 补全
+            layout = {key: current[key] for key in layout}
+        self._write_embedding_version(layout, status)
+
+        if status == EMBEDDING_BUILDING:
+            # 同一时间只补全一个版本：更早登记、尚未完成的迁移被新配置取代
+            superseded = [vid for vid, version in versions.items() if version["status"] == EMBEDDING_BUILDING and vid != configured]
+            if superseded:
+                self._set_embedding_status(superseded, EMBEDDING_RETIRED)
+            active = [vid for vid, version in versions.items() if version["status"] == EMBEDDING_ACTIVE]
+            logger.warning(f"🔀 embedding 配置变为 {configured}，已登记为新版本；查询继续使用 {active}，"
+                           f"请运行 `python main.py --reembed` 补全历史数据后自动切换")
+
+    def _set_embedding_status(self, version_ids, status):
+        self.run_write(
+            "MATCH (v:EmbeddingVersion) WHERE v.id IN $ids SET v.status = $status, v.updated_at = datetime()",
+            ids=list(version_ids), status=status
+        )
+        self._embedding_versions = None
+
+    def activate_embedding_version(self, version_id):
+        """把一个版本切换为生效版本，原生效版本退役 (同一事务内完成，查询端不会看到两个或零个生效版本)"""
+        self.run_write_batch([
+            ("""
+            MATCH (v:EmbeddingVersion {status: $active}) WHERE v.id <> $id
+            SET v.status = $retired, v.updated_at = datetime()
+            """, {"id": version_id, "active": EMBEDDING_ACTIVE, "retired": EMBEDDING_RETIRED}),
+            ("""
+            MATCH (v:EmbeddingVersion {id: $id})
+            SET v.status = $active, v.activated_at = datetime(), v.updated_at = datetime()
+            """, {"id": version_id, "active": EMBEDDING_ACTIVE}),
+        ])
+        self._embedding_versions = None
+
+    def get_embedding_coverage(self, version):
+        """
+        某个版本的向量覆盖情况
+        :return: Dict[标签, (已有向量的节点数, 节点总数)]
+        """
+        coverage = {}
+        for label in EMBEDDING_LABELS:
+            records = self.run_read(
+                f"MATCH (n:{label}) RETURN count(n) AS total, count(n.`{version['property']}`) AS done"
+            )
+            coverage[label] = (records[0]["done"], records[0]["total"])
+        return coverage
+
+    def get_missing_embeddings(self, version, label, limit, exclude_ids=None):
+        """
+        读取一批还没有该版本向量的节点及其文本 (Chunk.content / Community.summary)
+        :param exclude_ids: 本轮已经失败过的节点，避免反复读取同一批
+        :return: List[Dict] {id, text}
+        """
+        cypher = f"""
+        MATCH (n:{label}) WHERE n.`{version['property']}` IS NULL AND NOT n.id IN $exclude
+        RETURN n.id AS id, n.{EMBEDDING_LABELS[label]} AS text
+        LIMIT $limit
+        """
+        return self.run_read(cypher, exclude=list(exclude_ids or []), limit=limit)
+
+    def set_embeddings(self, version, label, rows):
+        """
+        写入一批节点的某个版本的向量 (reduced 模式下 Chunk 同时写入降维向量)
+        :param rows: List[(id, embedding)]
+        """
+        reduced = label == "Chunk" and settings.VECTOR_STORAGE_MODE == "reduced"
+        batch = [{
+            "id": node_id,
+            "embedding": as_driver_list(embedding),
+            "reduced": as_driver_list(reduce_embedding(embedding, settings.VECTOR_REDUCED_DIM)) if reduced else None,
+        } for node_id, embedding in rows]
+        reduced_clause = f", n.`{version['reduced_property']}` = row.reduced" if reduced else ""
+        self.run_write(f"""
+        UNWIND $batch AS row
+        MATCH (n:{label} {{id: row.id}})
+        SET n.`{version['property']}` = row.embedding{reduced_clause}
+        """, batch=batch)
+
+    def drop_embedding_version(self, version):
+        """删除一个已退役版本的向量索引、向量属性和登记记录"""
+        if version["status"] != EMBEDDING_RETIRED:
+            raise ValueError(f"只能删除已退役的 embedding 版本: {version['id']} ({version['status']})")
+        with self._session() as session:
+            for index_name in (version["index"], version["reduced_index"], version["community_index"]):
+                session.run(f"DROP INDEX {index_name} IF EXISTS")
+            for label in EMBEDDING_LABELS:
+                session.run(f"""
+                MATCH (n:{label}) WHERE n.`{version['property']}` IS NOT NULL OR n.`{version['reduced_property']}` IS NOT NULL
+                CALL {{ WITH n REMOVE n.`{version['property']}`, n.`{version['reduced_property']}` }} IN TRANSACTIONS OF 1000 ROWS
+                """)
+        self.run_write("MATCH (v:EmbeddingVersion {id: $id}) DELETE v", id=version["id"])
+        self._embedding_versions = None
+
+    def migrate_relation_schema(self):
+        """
+        graph.relation_schema 切换后迁移已有的关系：
+        - dynamic -> fixed: 关系类型名写入 predicate 属性，类型统一为 RELATES / MENTIONS (纯 Cypher，分批提交)
+        - fixed -> dynamic: 按 predicate 的取值逐个还原为关系类型
+        :return: 是否迁移成功
+        """
+        if not self.driver:
+            return False
+
+        logger.info(f"⚡ 正在把已有关系迁移为 {settings.GRAPH_RELATION_SCHEMA} 模式...")
+        try:
+            # CALL {} IN TRANSACTIONS 只能在自动提交事务中执行
+            with self._session() as session:
+                if settings.GRAPH_RELATION_SCHEMA == "fixed":
+                    session.run(f"""
+                    MATCH (h:Concept)-[r]->(t:Concept) WHERE type(r) <> '{RELATION_TYPE}'
+                    CALL {{
+                        WITH h, r, t
+                        MERGE (h)-[n:{RELATION_TYPE} {{predicate: type(r)}}]->(t)
+                        SET n.source = r.source
+                        DELETE r
+                    }} IN TRANSACTIONS OF 1000 ROWS
+                    """)
+                    session.run(f"""
+                    MATCH (s:Concept)-[r]->(c:Chunk) WHERE type(r) <> '{MENTION_TYPE}'
+                    CALL {{
+                        WITH s, r, c
+                        MERGE (s)-[n:{MENTION_TYPE} {{predicate: type(r)}}]->(c)
+                        DELETE r
+                    }} IN TRANSACTIONS OF 1000 ROWS
+                    """)
+                else:
+                    for rel_type, default in ((RELATION_TYPE, "RELATED_TO"), (MENTION_TYPE, "HAS_MENTION")):
+                        predicates = [record["predicate"] for record in session.run(
+                            f"MATCH ()-[r:{rel_type}]->() RETURN DISTINCT r.predicate AS predicate"
+                        )]
+                        for predicate in predicates:
+                            session.run(f"""
+                            MATCH (h)-[r:{rel_type}]->(t) WHERE r.predicate = $predicate
+                            CALL {{
+                                WITH h, r, t
+                                MERGE (h)-[n:`{make_relation_type(predicate, default)}`]->(t)
+                                SET n.source = r.source
+                                DELETE r
+                            }} IN TRANSACTIONS OF 1000 ROWS
+                            """, predicate=predicate)
+            logger.info("⚡ 关系迁移完成")
+            return True
+        except Exception as e:
+            logger.error(f"❌ 迁移关系失败: {e}")
+            return False
 
     def save_triplets(self, triplets, source_id="unknown"):
         """
-        高性能保存三元组：按关系类型分组 + UNWIND 批量写入
+        高性能保存三元组：UNWIND 批量写入
+        - fixed: 所有关系都是 RELATES，原始谓词存为 predicate 属性，整批只有一条参数化语句 (查询计划可复用)
+        - dynamic: 每个谓词是一种关系类型，按关系类型分组后逐组写入
         :param triplets: List[Dict] [{"head":..., "relation":..., "tail":...}]
         :param source_id: 来源标识
+        :return: 是否写入成功
         """
-        if not self.driver or not triplets:
-            return
+        if not self.driver:
+            return False
+        if not triplets:
+            return True
 
-        # 1. 内存分组
-        grouped_data = {}
-        for item in triplets:
-            rel_type = item["relation"]
-            safe_rel_type = "_".join(rel_type.split()).upper()
-            if not safe_rel_type:
-                safe_rel_type = "RELATED_TO"
-                
-            if safe_rel_type not in grouped_data:
-                grouped_data[safe_rel_type] = []
-            
-            grouped_data[safe_rel_type].append({
+        self.ensure_schema()
+
+        if settings.GRAPH_RELATION_SCHEMA == "fixed":
+            batch_data = [{
                 "h_name": item["head"],
                 "t_name": item["tail"],
+                "predicate": (item["relation"] or "").strip() or "RELATED_TO",
                 "source": source_id
-            })
-
-        count = 0
-        try:
-            with self.driver.session() as session:
-                # 使用事务写入
-                with session.begin_transaction() as tx:
-                    for rel_type, batch_data in grouped_data.items():
-                        cypher = f"""
-                        UNWIND $batch AS row
-                        MERGE (h:Concept {{name: row.h_name}})
-                        MERGE (t:Concept {{name: row.t_name}})
-                        MERGE (h)-[r:`{rel_type}`]->(t)
-                        SET r.source = row.source
-                        """
-                        tx.run(cypher, batch=batch_data)
-                        count += len(batch_data)
-                    
-                    tx.commit()
+            } for item in triplets]
+            statements = [(f"""
+            UNWIND $batch AS row
+            MERGE (h:Concept {{name: row.h_name}})
+            ON CREATE SET h.created_at = timestamp()
+            MERGE (t:Concept {{name: row.t_name}})
+            ON CREATE SET t.created_at = timestamp()
+            MERGE (h)-[r:{RELATION_TYPE} {{predicate: row.predicate}}]->(t)
+            SET r.source = row.source
+            """, batch_data)]
+        else:
+            # 1. 内存分组
+            grouped_data = {}
+            for item in triplets:
+                safe_rel_type = make_relation_type(item["relation"], "RELATED_TO")
+                if safe_rel_type not in grouped_data:
+                    grouped_data[safe_rel_type] = []
+                
+                grouped_data[safe_rel_type].append({
+                    "h_name": item["head"],
+                    "t_name": item["tail"],
+                    "source": source_id
+                })
+
+            statements = [(f"""
+            UNWIND $batch AS row
+            MERGE (h:Concept {{name: row.h_name}})
+            ON CREATE SET h.created_at = timestamp()
+            MERGE (t:Concept {{name: row.t_name}})
+            ON CREATE SET t.created_at = timestamp()
+            MERGE (h)-[r:`{rel_type}`]->(t)
+            SET r.source = row.source
+            """, batch_data) for rel_type, batch_data in grouped_data.items()]
+
+        count = sum(len(batch_data) for _, batch_data in statements)
+        try:
+            # 使用托管事务写入，瞬时错误自动重试
+            self.run_write_batch([(cypher, {"batch": batch_data}) for cypher, batch_data in statements])
             
             logger.info(f"💾 [Batch] 已向 Neo4j 存入 {count} 个关系 (Source: {source_id})")
+            return True
             
         except Exception as e:
             logger.error(f"❌ 批量保存三元组失败: {e}")
+            return False
 
     def save_chunks(self, chunks, source_id="unknown"):
         """
         高性能保存块：UNWIND 批量写入
+        Chunk 按内容 hash (id) MERGE，重复写入是幂等的
+        :return: 是否写入成功
         """
-        if not self.driver or not chunks:
-            return
+        if not self.driver:
+            return False
+        if not chunks:
+            return True
+
+        self.ensure_schema()
 
         # 预处理
+        reduced = settings.VECTOR_STORAGE_MODE == "reduced"
+        # 每个仍在使用的 embedding 版本各写一组属性：当前配置的版本取 item["embedding"]，
+        # 迁移期间的另一个版本取 item["embeddings"][版本号] (由流水线用对应的模型计算)
+        configured = embedding_version()
+        targets = self.get_embedding_targets()
+        set_clauses = []
+        for i, version in enumerate(targets):
+            full_prop, reduced_prop = version["property"], version["reduced_property"]
+            if version["id"] == configured:
+                set_clauses.append(f"c.`{full_prop}` = row.v{i}, c.`{reduced_prop}` = row.v{i}_reduced")
+            else:
+                # 其他版本的向量可能缺失 (由 --reembed 补全)，缺失时不覆盖已有的值
+                set_clauses.append(f"c.`{full_prop}` = coalesce(row.v{i}, c.`{full_prop}`)")
+                if reduced:
+                    set_clauses.append(f"c.`{reduced_prop}` = coalesce(row.v{i}_reduced, c.`{reduced_prop}`)")
+
         batch_data = []
         for item in chunks:
-            batch_data.append({
+            row = {
+                "id": make_chunk_id(source_id, item["content"]),
                 "content": item["content"],
-                "embedding": item.get("embedding", None), # 新增 embedding 字段
                 "subject": item["subject"],
                 "predicate": item.get("predicate", "HAS_MENTION"),
                 "source": source_id
-            })
-
-        # 分组
-        grouped_chunks = {}
-        for item in batch_data:
-            pred = "_".join(item["predicate"].split()).upper()
-            if pred not in grouped_chunks:
-                grouped_chunks[pred] = []
-            grouped_chunks[pred].append(item)
-
-        total = 0
-        try:
-            with self.driver.session() as session:
-                with session.begin_transaction() as tx:
-                    for pred, batch in grouped_chunks.items():
-                        cypher = f"""
-                        UNWIND $batch AS row
-                        MERGE (s:Concept {{name: row.subject}})
-                        CREATE (c:Chunk {{content: row.content, source: row.source}})
-                        SET c.embedding = row.embedding  // 设置向量属性
-                        CREATE (s)-[:`{pred}`]->(c)
-                        """
-                        tx.run(cypher, batch=batch)
-                        total += len(batch)
-                    tx.commit()
+            }
+            for i, version in enumerate(targets):
+                embedding = item.get("embedding") if version["id"] == configured else item.get("embeddings", {}).get(version["id"])
+                row[f"v{i}"] = as_driver_list(embedding) # float32 向量在驱动边界才转换为 list
+                # reduced 模式下用于一阶段检索的降维向量
+                row[f"v{i}_reduced"] = as_driver_list(reduce_embedding(embedding, settings.VECTOR_REDUCED_DIM)) if reduced and embedding else None
+            batch_data.append(row)
+
+        # fixed: 整批一条语句，谓词作为 MENTIONS 的属性；dynamic: 按谓词分组，每组一种关系类型
+        if settings.GRAPH_RELATION_SCHEMA == "fixed":
+            for item in batch_data:
+                item["predicate"] = (item["predicate"] or "").strip() or "HAS_MENTION"
+            grouped_chunks = {f"{MENTION_TYPE} {{predicate: row.predicate}}": batch_data}
+        else:
+            grouped_chunks = {}
+            for item in batch_data:
+                pred = f"`{make_relation_type(item['predicate'], 'HAS_MENTION')}`"
+                if pred not in grouped_chunks:
+                    grouped_chunks[pred] = []
+                grouped_chunks[pred].append(item)
+
+        statements = []
+        for rel_pattern, batch in grouped_chunks.items():
+            cypher = f"""
+            UNWIND $batch AS row
+            MERGE (s:Concept {{name: row.subject}})
+            ON CREATE SET s.created_at = timestamp()
+            MERGE (c:Chunk {{id: row.id}})
+            SET c.content = row.content,
+                c.source = row.source,
+                {", ".join(set_clauses)}
+            MERGE (s)-[:{rel_pattern}]->(c)
+            """
+            statements.append((cypher, {"batch": batch}))
+
+        total = len(batch_data)
+        try:
+            self.run_write_batch(statements)
             
             logger.info(f"📄 [Batch] 已向 Neo4j 存入 {total} 个文本块节点")
+            return True
             
         except Exception as e:
             logger.error(f"❌ 批量保存 Chunk 失败: {e}")
+            return False
 
     def prune_source_data(self, source_id):
         """
         在写入新数据前，清理该 source_id 对应的旧数据（Chunk 和 关系）
         注意：不删除 Concept 节点，因为它们可能是公用的
+        :return: 是否清理成功
         """
         if not self.driver or not source_id:
-            return
+            return False
+
+        # 1. 删除该来源的所有 Chunk 节点 (DETACH DELETE 会自动删除连接的关系)
+        statements = [("MATCH (c:Chunk {source: $source}) DETACH DELETE c", {"source": source_id})]
+
+        # 2. 删除该来源的所有关系 (也就是 Triplets 建立的关系)
+        # 这里的逻辑是：删除属性 source = current_source 的所有边
+        # fixed 模式下关系类型固定，可以走 RELATES.source 上的关系索引，而不是扫描全部关系
+        if settings.GRAPH_RELATION_SCHEMA == "fixed":
+            statements.append((f"MATCH ()-[r:{RELATION_TYPE}]->() WHERE r.source = $source DELETE r", {"source": source_id}))
+        else:
+            statements.append(("MATCH ()-[r]-() WHERE r.source = $source DELETE r", {"source": source_id}))
 
         try:
-            with self.driver.session() as session:
-                # 1. 删除该来源的所有 Chunk 节点 (DETACH DELETE 会自动删除连接的关系)
-                session.run("MATCH (c:Chunk {source: $source}) DETACH DELETE c", source=source_id)
-                
-                # 2. 删除该来源的所有关系 (也就是 Triplets 建立的关系)
-                # 这里的逻辑是：删除属性 source = current_source 的所有边
-                session.run("MATCH ()-[r]-() WHERE r.source = $source DELETE r", source=source_id)
-                
+            self.run_write_batch(statements)
             logger.info(f"🧹 已清理旧数据 (Source: {source_id})")
+            return True
         except Exception as e:
             logger.error(f"❌ 清理旧数据失败: {e}")
+            return False
 
-    def get_source_hash(self, source_id):
-        """获取指定源在数据库中存储的 Hash 版本"""
+    def delete_source(self, source_id):
+        """
+        笔记被删除时，从图中移除该来源：Chunk、关系、版本记录，
+        以及因此不再与任何内容相连的 Concept (被其他笔记引用的概念会保留)
+        :return: 是否删除成功
+        """
         if not self.driver or not source_id:
-            return None
+            return False
+
+        try:
+            touched = self.run_read("""
+            CALL {
+                MATCH (c:Concept)-[r]-() WHERE r.source = $source RETURN c
+                UNION
+                MATCH (c:Concept)-->(:Chunk {source: $source}) RETURN c
+            }
+            RETURN collect(DISTINCT c.name) AS names
+            """, source=source_id)[0]["names"]
+        except Exception as e:
+            logger.error(f"❌ 读取来源关联的概念失败: {e}")
+            return False
+
+        if not self.prune_source_data(source_id):
+            return False
+
         try:
-            with self.driver.session() as session:
-                result = session.run(
-                    "MATCH (m:SourceMetadata {id: $id}) RETURN m.hash AS hash LIMIT 1",
-                    id=source_id
-                ).single()
-                return result["hash"] if result else None
-        except Exception:
+            self.run_write_batch([
+                ("MATCH (m:SourceMetadata {id: $id}) DELETE m", {"id": source_id}),
+                # 社区的 HAS_MEMBER 不算内容，只剩这类关系的概念同样删除
+                ("""
+                MATCH (c:Concept) WHERE c.name IN $names
+                  AND NOT EXISTS { (c)-[r]-() WHERE type(r) <> 'HAS_MEMBER' }
+                DETACH DELETE c
+                """, {"names": touched}),
+            ])
+            logger.info(f"🗑️ 已从图中移除来源 {source_id}")
+            return True
+        except Exception as e:
+            logger.error(f"❌ 删除来源失败: {e}")
+            return False
+
+    def get_source_hash(self, source_id):
+        """
+        获取指定源在数据库中存储的 Hash 版本 (不存在时返回 None)
+        读取失败时抛出异常，而不是返回 None：调用方会把 None 当作 "需要重新写入"
+        """
+        if not self.driver or not source_id:
             return None
+        records = self.run_read("MATCH (m:SourceMetadata {id: $id}) RETURN m.hash AS hash LIMIT 1", id=source_id)
+        return records[0]["hash"] if records else None
 
     def update_source_hash(self, source_id, new_hash):
-        """更新源的 Hash 版本"""
+        """更新源的 Hash 版本，返回是否成功"""
         if not self.driver or not source_id:
-            return
+            return False
         try:
-            with self.driver.session() as session:
-                session.run(
-                    "MERGE (m:SourceMetadata {id: $id}) SET m.hash = $hash",
-                    id=source_id, hash=new_hash
-                )
+            self.run_write("MERGE (m:SourceMetadata {id: $id}) SET m.hash = $hash", id=source_id, hash=new_hash)
+            return True
         except Exception as e:
             logger.error(f"❌ 更新元数据失败: {e}")
+            return False
+
+    def get_concept_names(self):
+        """读取所有 Concept 节点的名字 (用于构建实体消歧索引)"""
+        if not self.driver:
+            return []
+        try:
+            records = self.run_read("MATCH (c:Concept) RETURN c.name AS name")
+            return [record["name"] for record in records if record["name"]]
+        except Exception as e:
+            logger.error(f"❌ 读取概念列表失败: {e}")
+            return []
+
+    def get_source_hashes(self, source_ids=None):
+        """
+        批量读取源的 Hash 版本
+        :param source_ids: 为 None 时读取全部
+        :return: Dict[source_id, hash]；读取失败时抛出异常 (同 get_source_hash)
+        """
+        if not self.driver:
+            return {}
+        cypher = """
+        MATCH (m:SourceMetadata)
+        WHERE $ids IS NULL OR m.id IN $ids
+        RETURN m.id AS id, m.hash AS hash
+        """
+        return {record["id"]: record["hash"] for record in self.run_read(cypher, ids=source_ids)}
+
+    def get_concept_graph(self):
+        """
+        读取概念图 (用于社区划分)
+        :return: (edges, concept_sources)
+            edges: List[Dict] 概念之间的关系 {"head", "relation", "tail", "source"}
+            concept_sources: Dict[概念名, List[source_id]] 概念的文本块所属的来源
+        """
+        if not self.driver:
+            return [], {}
+        try:
+            edges = self.run_read("""
+            MATCH (h:Concept)-[r]->(t:Concept)
+            RETURN h.name AS head, coalesce(r.predicate, type(r)) AS relation, t.name AS tail, r.source AS source
+            """)
+            concept_sources = {record["name"]: record["sources"] for record in self.run_read("""
+            MATCH (c:Concept)-->(ch:Chunk)
+            RETURN c.name AS name, collect(DISTINCT ch.source) AS sources
+            """)}
+            return edges, concept_sources
+        except Exception as e:
+            logger.error(f"❌ 读取概念图失败: {e}")
+            return [], {}
+
+    def get_concept_chunks(self, names, limit=8):
+        """读取一组概念的部分文本块 (用于生成社区摘要)"""
+        if not self.driver or not names:
+            return []
+        try:
+            return self.run_read("""
+            MATCH (c:Concept)-->(ch:Chunk) WHERE c.name IN $names
+            RETURN DISTINCT c.name AS entity, ch.content AS content
+            LIMIT $limit
+            """, names=names, limit=limit)
+        except Exception as e:
+            logger.error(f"❌ 读取概念文本块失败: {e}")
+            return []
+
+    def get_communities(self):
+        """
+        读取已有社区 Dict[community_id, {"fingerprint", "members"}]
+        读取失败时抛出异常：不能当作 "没有社区"，否则会重新生成全部摘要
+        """
+        if not self.driver:
+            return {}
+        records = self.run_read("""
+        MATCH (m:Community)
+        RETURN m.id AS id, m.fingerprint AS fingerprint, [(m)-[:HAS_MEMBER]->(c:Concept) | c.name] AS members
+        """)
+        return {record["id"]: {"fingerprint": record["fingerprint"], "members": record["members"]} for record in records}
+
+    def save_community(self, community_id, members, summary, embeddings, fingerprint):
+        """
+        写入 (或覆盖) 一个社区节点及其 HAS_MEMBER 关系，返回是否成功
+        :param embeddings: Dict[embedding 版本号, 摘要向量]，每个仍在使用的版本各写一个属性
+        """
+        if not self.driver:
+            return False
+
+        self.ensure_schema()
+        # 摘要变了，旧向量也随之作废；缺失的版本写入 null (删除属性)，由 --reembed 补全
+        params = {}
+        set_clauses = []
+        for i, version in enumerate(self.get_embedding_targets()):
+            params[f"v{i}"] = as_driver_list(embeddings.get(version["id"]))
+            set_clauses.append(f"m.`{version['property']}` = $v{i},")
+        try:
+            self.run_write_batch([
+                (f"""
+                MERGE (m:Community {{id: $id}})
+                SET m.summary = $summary,
+                    {" ".join(set_clauses)}
+                    m.fingerprint = $fingerprint,
+                    m.size = size($members),
+                    m.updated_at = datetime()
+                WITH m
+                OPTIONAL MATCH (m)-[old:HAS_MEMBER]->()
+                DELETE old
+                """, {"id": community_id, "summary": summary, "fingerprint": fingerprint, "members": members, **params}),
+                ("""
+                MATCH (m:Community {id: $id})
+                UNWIND $members AS name
+                MATCH (c:Concept {name: name})
+                MERGE (m)-[:HAS_MEMBER]->(c)
+                """, {"id": community_id, "members": members}),
+            ])
+            return True
+        except Exception as e:
+            logger.error(f"❌ 保存社区失败 ({community_id}): {e}")
+            return False
+
+    def delete_communities(self, community_ids):
+        """删除已经不存在的社区"""
+        if not self.driver or not community_ids:
+            return True
+        try:
+            self.run_write("MATCH (m:Community) WHERE m.id IN $ids DETACH DELETE m", ids=list(community_ids))
+            return True
+        except Exception as e:
+            logger.error(f"❌ 删除过期社区失败: {e}")
+            return False
+
+    def get_concept_names_since(self, since=None):
+        """
+        增量读取概念名 (用于查询端的概念链接)
+        :param since: 上次读取到的最大 created_at (毫秒)，None 表示全量读取
+        :return: (names, latest)，latest 为本次结果中最大的 created_at
+        """
+        if not self.driver:
+            return [], since
+        # 用 >= 而不是 >：同一毫秒内稍晚提交的概念不会漏掉，重复的名字由调用方去重
+        cypher = """
+        MATCH (c:Concept)
+        WHERE $since IS NULL OR c.created_at >= $since
+        RETURN c.name AS name, c.created_at AS created_at
+        """
+        try:
+            records = self.run_read(cypher, since=since)
+        except Exception as e:
+            logger.error(f"❌ 增量读取概念列表失败: {e}")
+            return [], since
+
+        names = [record["name"] for record in records if record["name"]]
+        timestamps = [record["created_at"] for record in records if record["created_at"] is not None]
+        # 早于 created_at 引入的概念没有该属性，全量读取一次之后就不再需要它们
+        latest = max(timestamps, default=since if since is not None else 0)
+        return names, latest
 
     def clear_database(self):
         """危险操作：清空数据库"""
         if self.driver:
             try:
-                with self.driver.session() as session:
-                    session.run("MATCH (n) DETACH DELETE n")
+                self.run_write("MATCH (n) DETACH DELETE n")
                 logger.warning("⚠️ 数据库已清空！")
             except Exception as e:
                 logger.error(f"清空失败: {e}")
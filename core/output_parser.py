@@ -0,0 +1,182 @@
+import json
+import logging
+
+logger = logging.getLogger(__name__)
+
+# strict=False 允许字符串里出现未转义的换行等控制字符 (LLM 输出中很常见)
+_decoder = json.JSONDecoder(strict=False)
+_SKIP_CHARS = " \t\r\n,"
+# 数组元素之间多出来的右括号 (如 [{...}}, {...}]) 不是元素，跳过它们不算丢失数据
+_STRAY_CHARS = _SKIP_CHARS + "}"
+
+# 每类提取结果的必填字段，缺字段的对象会被丢弃
+REQUIRED_FIELDS = {
+    "triplets": ("head", "relation", "tail"),
+    "chunks": ("subject", "content"),
+}
+
+
+class _Unparsable(Exception):
+    """当前位置无法解析出任何值"""
+
+
+def _skip(s, i):
+    """跳过空白和多余的逗号 (顺带兼容尾逗号、重复逗号)"""
+    while i < len(s) and s[i] in _SKIP_CHARS:
+        i += 1
+    return i
+
+def _salvage_value(s, i):
+    """
+    从位置 i 解析一个 JSON 值
+    :return: (value, end, complete)，complete=False 表示值被截断或中途有错误，只保留了完整部分
+    """
+    i = _skip(s, i)
+    if i >= len(s):
+        raise _Unparsable("unexpected end")
+
+    if s[i] == "{":
+        return _salvage_object(s, i)
+    if s[i] == "[":
+        return _salvage_array(s, i)
+
+    try:
+        value, end = _decoder.raw_decode(s, i)
+    except json.JSONDecodeError as e:
+        raise _Unparsable(str(e))
+    return value, end, True
+
+def _salvage_array(s, i):
+    """逐个解析数组元素，截断或损坏的元素被丢弃，尽量跳到下一个对象继续"""
+    items = []
+    complete = True
+    i += 1
+
+    while True:
+        i = _skip(s, i)
+        if i >= len(s):
+            return items, i, False
+        if s[i] == "]":
+            return items, i + 1, complete
+
+        try:
+            value, end, ok = _salvage_value(s, i)
+        except _Unparsable:
+            value, end, ok = None, i, False
+
+        if ok:
+            items.append(value)
+            i = end
+            continue
+
+        # 元素不完整：丢弃它，并尝试重新同步到下一个对象
+        resume = s.find("{", max(end, i + 1))
+        close = s.find("]", max(end, i + 1))
+        if resume == -1 or (close != -1 and close < resume):
+            if close == -1:
+                return items, len(s), False
+            resume = close
+        # 跳过的只是多余的右括号时没有元素被丢弃，数组仍然完整
+        if s[i:resume].strip(_STRAY_CHARS):
+            complete = False
+        i = resume
+
+def _salvage_object(s, i, incomplete_keys=None):
+    """
+    逐个解析键值对，值不完整时保留已解析的部分并标记为不完整
+    :param incomplete_keys: 传入列表时，记录值不完整的键
+    """
+    obj = {}
+    complete = True
+    i += 1
+
+    while True:
+        i = _skip(s, i)
+        if i >= len(s):
+            return obj, i, False
+        if s[i] == "}":
+            return obj, i + 1, complete
+        if s[i] != '"':
+            return obj, len(s), False
+
+        try:
+            key, i = _decoder.raw_decode(s, i)
+        except json.JSONDecodeError:
+            return obj, len(s), False
+
+        i = _skip(s, i)
+        if i >= len(s) or s[i] != ":":
+            return obj, len(s), False
+
+        try:
+            value, i, ok = _salvage_value(s, i + 1)
+        except _Unparsable:
+            return obj, len(s), False
+
+        obj[key] = value
+        if not ok:
+            complete = False
+            if incomplete_keys is not None:
+                incomplete_keys.append(key)
+            if i >= len(s):
+                return obj, i, False
+
+def strip_code_fences(content):
+    """去掉 Markdown 代码块标记以及 JSON 前后的说明文字"""
+    text = content.replace("```json", "").replace("```", "")
+    start = text.find("{")
+    return text[start:] if start != -1 else ""
+
+def parse_json_lenient(content):
+    """
+    容错解析 LLM 返回的 JSON 对象：先尝试标准解析，失败后逐层抢救完整的部分
+    :return: (data: dict, complete: bool, incomplete_keys: list)
+    """
+    text = strip_code_fences(content or "")
+    if not text:
+        return {}, False, []
+
+    try:
+        data, _ = _decoder.raw_decode(text)
+        if isinstance(data, dict):
+            return data, True, []
+    except json.JSONDecodeError:
+        pass
+
+    incomplete_keys = []
+    data, _, complete = _salvage_object(text, 0, incomplete_keys)
+    return data, complete, incomplete_keys
+
+def _is_valid_item(item, required):
+    return isinstance(item, dict) and all(isinstance(item.get(field), str) and item[field].strip() for field in required)
+
+def validate_extraction(data):
+    """
+    只保留字段齐全的三元组和块
+    :return: (triplets, chunks)
+    """
+    result = []
+    for key, required in REQUIRED_FIELDS.items():
+        items = data.get(key, [])
+        if not isinstance(items, list):
+            items = []
+        valid = [item for item in items if _is_valid_item(item, required)]
+        if len(valid) < len(items):
+            logger.warning(f"⚠️ 丢弃 {len(items) - len(valid)} 个字段不完整的 {key} 对象")
+        result.append(valid)
+    return tuple(result)
+
+def parse_extraction_output(content):
+    """
+    解析单篇笔记的提取结果
+    :return: (triplets, chunks, failed_keys)
+             failed_keys 为被截断、损坏或截断前尚未出现的字段 (如 ["chunks"])，为空表示解析完整
+    """
+    data, complete, incomplete_keys = parse_json_lenient(content)
+
+    failed_keys = []
+    if not complete:
+        failed_keys = [key for key in REQUIRED_FIELDS if key in incomplete_keys or key not in data]
+
+    triplets, chunks = validate_extraction(data)
+    return triplets, chunks, failed_keys
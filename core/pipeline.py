@@ -1,64 +1,268 @@
 import os
+import re
 import logging
 from config import settings
-from core.extractor import extract_hybrid_data
+from core.extractor import extract_hybrid_data, extract_hybrid_data_batch, build_prompt, compute_prompt_hash, remove_cache
 from core.neo4j_manager import Neo4jManager
+from core.embedding import get_embeddings_batch, embedding_version
+from core.run_journal import RunJournal, DeadLetterQueue
+from core.entity_resolver import EntityResolver
+from core.community import refresh_communities
+from core.profiler import profiled
+from utils.file_ops import load_file_content
 
 logger = logging.getLogger(__name__)
 
-def run_graph_pipeline(notes_data, prompt_template):
+def make_source_id(filename):
+    """使用真实文件名生成 source_id (去掉 .md 后缀，并确保文件名安全)"""
+    base_name = os.path.splitext(filename)[0]
+    safe_name = re.sub(r'[^\u4e00-\u9fa5a-zA-Z0-9_\-]', '_', base_name)
+    return f"note_{safe_name}"
+
+def _extract_window(window, prompt_template):
+    """
+    提取一批笔记，返回 Dict[source_id, (triplets, chunks, current_hash)]
+    开启批量模式时，短笔记会被装进同一次 LLM 请求
+    """
+    if settings.EXTRACTION_BATCH_ENABLED:
+        notes = [{"source_id": item["source_id"], "content": item["content"]} for item in window]
+        return extract_hybrid_data_batch(notes, prompt_template)
+
+    return {
+        item["source_id"]: extract_hybrid_data(item["content"], prompt_template, source_id=item["source_id"])
+        for item in window
+    }
+
+def _embed_other_versions(neo4j_mgr, source_id, chunks):
+    """
+    embedding 迁移期间 (登记表中同时有生效版本和正在补全的版本)，
+    用另一个版本的模型为新写入的块计算向量，保证新旧两个索引都能检索到新笔记
+    失败时只记录警告：building 版本由 --reembed 补全，生效版本下次写入该笔记时重试
+    """
+    configured = embedding_version()
+    for version in neo4j_mgr.get_embedding_targets():
+        if version["id"] == configured:
+            continue
+        vectors = get_embeddings_batch([chunk["content"] for chunk in chunks], model=version["model"], dimensions=version["dim"])
+        for chunk, vector in zip(chunks, vectors):
+            if vector:
+                chunk.setdefault("embeddings", {})[version["id"]] = vector
+        missing = sum(1 for vector in vectors if not vector)
+        if missing:
+            logger.warning(f"⚠️ [{source_id}] {missing} 个文本块未能生成 {version['id']} 版本的向量")
+
+def _write_note(neo4j_mgr, source_id, triplets, chunks, current_hash):
+    """
+    把单篇笔记同步到 Neo4j，返回是否成功
+    只有全部写入成功后才更新版本号，失败时下次运行会重新写入
+    """
+    # 先清理该文件的旧数据，防止重复堆积
+    if not neo4j_mgr.prune_source_data(source_id):
+        return False
+    if not neo4j_mgr.save_triplets(triplets, source_id=source_id):
+        return False
+    _embed_other_versions(neo4j_mgr, source_id, chunks)
+    if not neo4j_mgr.save_chunks(chunks, source_id=source_id):
+        return False
+    # 更新数据库中的版本号
+    return neo4j_mgr.update_source_hash(source_id, current_hash)
+
+def _build_resolver(neo4j_mgr):
+    """创建实体消歧器；本地还没有索引时，先用数据库中已有的概念初始化"""
+    if not settings.ENTITY_RESOLUTION_ENABLED:
+        return None
+    resolver = EntityResolver()
+    if not os.path.exists(resolver.index_path):
+        for name in neo4j_mgr.get_concept_names():
+            resolver.register(name)
+    return resolver
+
+@profiled("run_graph_pipeline")
+def run_graph_pipeline(notes_data, prompt_template, resume=True, neo4j_mgr=None):
     """
     执行图谱构建流水线：提取 -> 存入 Neo4j
     不再进行本地绘图
+    每篇笔记的阶段 (loaded / extracted / embedded / written) 记录在运行日志中，
+    中断后重新运行只处理尚未完成的笔记；失败的笔记进入死信队列
+    :param resume: 为 False 时忽略运行日志，重新检查所有笔记
+    :param neo4j_mgr: 复用已有的连接 (watch 模式下常驻)，为 None 时新建
     """
     # 实例化 Neo4j 管理器
-    neo4j_mgr = Neo4jManager()
-    
+    neo4j_mgr = neo4j_mgr or Neo4jManager()
+
     if not neo4j_mgr.driver:
         logger.error("❌ 无法连接到 Neo4j，流程终止。")
         return
 
-    logger.info(f"🚀 开始构建知识图谱，共 {len(notes_data)} 篇笔记待处理...")
+    journal = RunJournal()
+    dead_letters = DeadLetterQueue()
+    resolver = _build_resolver(neo4j_mgr)
 
+    # 1. 计算每篇笔记的版本号，跳过上次运行已经完成的笔记
+    pending = []
     for i, note_obj in enumerate(notes_data):
-        # note_obj 是一个字典: {"filename": "...", "content": "..."}
+        # note_obj 是一个字典: {"filename": "...", "content": "...", "filepath": "..."}
         filename = note_obj.get('filename', f"note_{i}.md")
-        note_content = note_obj.get('content', "")
-        
-        logger.info(f"[{i+1}/{len(notes_data)}] 正在分析: {filename} ...") 
-        
-        # 使用真实文件名生成 source_id (去掉 .md 后缀)
-        base_name = os.path.splitext(filename)[0]
-        # 再次确保文件名安全
-        import re
-        safe_name = re.sub(r'[^\u4e00-\u9fa5a-zA-Z0-9_\-]', '_', base_name)
-        source_id = f"note_{safe_name}"
-
-        # 1. 提取三元组和块 (这里有缓存机制)
-        triplets, chunks, current_hash = extract_hybrid_data(note_content, prompt_template, source_id=source_id)
-        
-        if not current_hash:
-            logger.warning(f"⚠️ 无法计算 hash，跳过入库: {filename}")
-            continue
+        content = note_obj.get('content', "")
+        source_id = make_source_id(filename)
+        note_hash = compute_prompt_hash(build_prompt(content, prompt_template))
 
-        # 2. 检查 Neo4j 中是否已存在相同版本的记录
-        existing_hash = neo4j_mgr.get_source_hash(source_id)
-        
-        if existing_hash == current_hash:
-            logger.info(f"⏭️ 笔记未变更且数据库已同步，跳过写入 (Source: {source_id})")
+        if resume and journal.is_done(source_id, note_hash):
+            dead_letters.remove(source_id)
             continue
 
-        # 3. 同步保存到 Neo4j
+        journal.record(source_id, note_hash, "loaded")
+        pending.append({"source_id": source_id, "filename": filename, "content": content, "hash": note_hash, "note": note_obj})
+
+    skipped = len(notes_data) - len(pending)
+    logger.info(f"🚀 开始构建知识图谱，共 {len(notes_data)} 篇笔记，其中 {skipped} 篇在上次运行中已完成，{len(pending)} 篇待处理...")
+
+    # 批量模式下按窗口提取，窗口内的短笔记可以共用一次请求，同时避免一次性把全部结果留在内存中
+    window_size = settings.EXTRACTION_BATCH_MAX_NOTES * 4 if settings.EXTRACTION_BATCH_ENABLED else 1
+
+    # 一次查询取回所有待处理笔记在数据库中的版本号，而不是逐篇往返
+    # 读取失败 (重试后仍失败) 时不能当作 "数据库中没有"，否则会触发全部重写；这些笔记留到下次重试
+    try:
+        existing_hashes = neo4j_mgr.get_source_hashes([item["source_id"] for item in pending]) if pending else {}
+    except Exception as e:
+        logger.error(f"❌ 读取数据库中的版本号失败，本次不写入: {e}")
+        for item in pending:
+            dead_letters.add(item["source_id"], item["note"], "loaded", f"读取版本号失败: {e}")
+        journal.close()
+        return
+
+    # 本次实际写入了 Neo4j 的笔记，用于增量更新社区摘要
+    written_sources = set()
+
+    try:
+        for start in range(0, len(pending), window_size):
+            window = pending[start:start + window_size]
+            for offset, item in enumerate(window, start=start):
+                logger.info(f"[{offset+1}/{len(pending)}] 正在分析: {item['filename']} ...")
+
+            # 2. 提取三元组和块 (这里有缓存机制)
+            try:
+                extracted = _extract_window(window, prompt_template)
+            except Exception as e:
+                logger.error(f"❌ 提取过程出错: {e}", exc_info=True)
+                extracted = {}
+
+            for item in window:
+                source_id = item["source_id"]
+                try:
+                    if _process_note(neo4j_mgr, journal, dead_letters, resolver, item, extracted.get(source_id),
+                                     existing_hashes.get(source_id)):
+                        written_sources.add(source_id)
+                except Exception as e:
+                    logger.error(f"❌ 处理笔记出错 (Source: {source_id}): {e}", exc_info=True)
+                    dead_letters.add(source_id, item["note"], "written", e)
+    finally:
+        journal.close()
+        if resolver:
+            resolver.save()
+
+    # 5. 离线阶段：只为受本次变更影响的社区重新生成摘要
+    try:
+        refresh_communities(neo4j_mgr, written_sources)
+    except Exception as e:
+        logger.error(f"❌ 更新社区摘要出错: {e}", exc_info=True)
+
+    if len(dead_letters):
+        logger.warning(f"📮 死信队列中有 {len(dead_letters)} 篇失败的笔记，可运行 `python main.py --retry-failed` 重试")
+    logger.info(f"✅ 所有笔记处理完成！")
+
+def _process_note(neo4j_mgr, journal, dead_letters, resolver, item, extracted, existing_hash=None):
+    """
+    处理单篇笔记提取之后的阶段：检查向量 -> 比对版本 -> 写库，并记录到运行日志
+    :param existing_hash: 数据库中该笔记的版本号 (由调用方批量读取)
+    :return: 本次是否向 Neo4j 写入了新数据
+    """
+    source_id, note_hash = item["source_id"], item["hash"]
+    triplets, chunks, current_hash = extracted or ([], [], "")
+
+    if not current_hash:
+        logger.warning(f"⚠️ 无法计算 hash，跳过入库: {item['filename']}")
+        dead_letters.add(source_id, item["note"], "extracted", "LLM 提取或 JSON 解析失败")
+        return False
+    journal.record(source_id, note_hash, "extracted")
+
+    # 缺少向量的块写入后无法被检索到，留到下次重试
+    missing = sum(1 for chunk in chunks if not chunk.get("embedding"))
+    if missing:
+        dead_letters.add(source_id, item["note"], "embedded", f"{missing} 个文本块缺失 Embedding")
+        return False
+    journal.record(source_id, note_hash, "embedded")
+
+    # 3. 检查 Neo4j 中是否已存在相同版本的记录
+    written = existing_hash != current_hash
+
+    if not written:
+        logger.info(f"⏭️ 笔记未变更且数据库已同步，跳过写入 (Source: {source_id})")
+    else:
+        # 4. 同步保存到 Neo4j
         logger.info(f"   └── 发现变更 (Old: {existing_hash[:6] if existing_hash else 'None'} -> New: {current_hash[:6]})...")
         logger.info(f"   └── 正在同步到 Neo4j (Source: {source_id}) ...")
-        
-        # 先清理该文件的旧数据，防止重复堆积
-        neo4j_mgr.prune_source_data(source_id)
-        
-        neo4j_mgr.save_triplets(triplets, source_id=source_id)
-        neo4j_mgr.save_chunks(chunks, source_id=source_id)
-        
-        # 更新数据库中的版本号
-        neo4j_mgr.update_source_hash(source_id, current_hash)
-        
-    logger.info(f"✅ 所有笔记处理完成！")
+
+        # 实体消歧：把不同写法的实体映射到已有的规范概念，避免图中出现重复节点
+        if resolver:
+            triplets, chunks = resolver.apply(triplets, chunks)
+
+        if not _write_note(neo4j_mgr, source_id, triplets, chunks, current_hash):
+            dead_letters.add(source_id, item["note"], "written", "写入 Neo4j 失败")
+            return False
+
+    # 只抢救出部分结果的笔记 (hash 带后缀) 不算完成，下次运行会重新提取
+    journal.record(source_id, current_hash, "written")
+    dead_letters.remove(source_id)
+    return written
+
+@profiled("remove_sources")
+def remove_sources(source_ids, neo4j_mgr=None):
+    """
+    笔记被删除后，把对应来源从图谱、提取缓存、运行日志和死信队列中一并移除，
+    并更新受影响的社区摘要
+    """
+    if not source_ids:
+        return
+    neo4j_mgr = neo4j_mgr or Neo4jManager()
+    if not neo4j_mgr.driver:
+        logger.error("❌ 无法连接到 Neo4j，无法删除来源。")
+        return
+
+    journal = RunJournal()
+    dead_letters = DeadLetterQueue()
+    removed = set()
+    try:
+        for source_id in source_ids:
+            if not neo4j_mgr.delete_source(source_id):
+                continue
+            remove_cache(source_id)
+            journal.forget(source_id)
+            dead_letters.remove(source_id)
+            removed.add(source_id)
+    finally:
+        journal.close()
+
+    try:
+        refresh_communities(neo4j_mgr, removed)
+    except Exception as e:
+        logger.error(f"❌ 更新社区摘要出错: {e}", exc_info=True)
+
+def retry_dead_letters(prompt_template):
+    """重新处理死信队列中的笔记 (从原文件重新读取内容)"""
+    entries = DeadLetterQueue().entries()
+    if not entries:
+        logger.info("📭 死信队列为空，无需重试。")
+        return
+
+    notes = []
+    for source_id, entry in entries.items():
+        filepath = entry.get("filepath")
+        content = load_file_content(filepath) if filepath else ""
+        if not content:
+            logger.warning(f"⚠️ 无法读取 {source_id} 的原文件 ({filepath})，跳过")
+            continue
+        notes.append({"filename": entry.get("filename") or os.path.basename(filepath), "filepath": filepath, "content": content})
+
+    logger.info(f"🔁 从死信队列重试 {len(notes)} 篇笔记...")
+    run_graph_pipeline(notes, prompt_template)
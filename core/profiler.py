@@ -0,0 +1,253 @@
+import cProfile
+import io
+import json
+import logging
+import os
+import pstats
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+from functools import wraps
+from config import settings
+
+logger = logging.getLogger(__name__)
+
+# 当前进程中正在运行的 Profiler (没有开启 --profile 时为 None，埋点只做一次判断)
+_active = None
+
+
+def get_active_profiler():
+    return _active
+
+
+@contextmanager
+def profile_section(name):
+    """
+    标记一段需要分析的代码 (流水线、单篇提取、一次查询)
+    未开启 --profile 时几乎没有开销
+    """
+    profiler = _active
+    if profiler is None:
+        yield
+        return
+    profiler.enter_section(name)
+    try:
+        yield
+    finally:
+        profiler.exit_section(name)
+
+
+def profiled(name):
+    """profile_section 的装饰器形式"""
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            with profile_section(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def _frame_label(frame):
+    code = frame.f_code
+    return f"{os.path.basename(code.co_filename)}:{code.co_name}"
+
+
+def _sum_db_hits(plan):
+    """递归累加 PROFILE 计划树中每个算子的 dbHits"""
+    if not plan:
+        return 0
+    return plan.get("dbHits", 0) + sum(_sum_db_hits(child) for child in plan.get("children", []))
+
+
+def _format_plan(plan, depth=0):
+    """把 PROFILE 计划树格式化为缩进文本"""
+    if not plan:
+        return []
+    line = f"{'  ' * depth}{plan.get('operatorType')}  rows={plan.get('rows', 0)}  dbHits={plan.get('dbHits', 0)}"
+    lines = [line]
+    for child in plan.get("children", []):
+        lines += _format_plan(child, depth + 1)
+    return lines
+
+
+class Profiler:
+    """
+    --profile 模式：在一次运行中同时收集
+    1. cProfile 函数级统计 (cprofile.pstats / cprofile.txt)
+    2. 采样式调用栈 (stacks.collapsed)，每行 "帧;帧;帧 次数"，可直接交给 flamegraph.pl 或 speedscope
+    3. tracemalloc 内存分配：各分析段前后快照的差异 (allocations.txt)
+    4. Neo4j PROFILE：Neo4jManager 执行的每条 Cypher 的 db hits、行数和执行计划 (neo4j_profile.json / .txt)
+    所有结果写入同一个报告目录 (默认 reports/profile-时间戳/)
+    只在 profile_section 标记的代码段内采样，交互式等待输入的时间不会混进报告
+    """
+
+    def __init__(self, report_dir=None):
+        timestamp = time.strftime("%Y%m%d-%H%M%S")
+        self.report_dir = report_dir or os.path.join(settings.PROFILE_OUTPUT_DIR, f"profile-{timestamp}")
+        self.sample_interval = settings.PROFILE_SAMPLE_INTERVAL_MS / 1000
+
+        self._cprofile = cProfile.Profile()
+        self._stacks = Counter()
+        self._samples = 0
+        self._sampler = None
+        self._stop_event = threading.Event()
+
+        # 分析段的嵌套深度；只有最外层进入/退出时才拍 tracemalloc 快照
+        self._depth = 0
+        self._lock = threading.Lock()
+        self._section_stats = defaultdict(lambda: {"calls": 0, "seconds": 0.0})
+        self._section_starts = []
+        self._snapshot = None
+        self._alloc_diff = Counter()
+        self._alloc_count = Counter()
+
+        # Cypher 文本 -> 汇总信息
+        self._queries = {}
+
+    # ---------------- 生命周期 ----------------
+    def start(self):
+        global _active
+        os.makedirs(self.report_dir, exist_ok=True)
+        tracemalloc.start(settings.PROFILE_TRACEMALLOC_FRAMES)
+        # cProfile 与采样一样只在分析段内开启 (见 enter_section)
+        self._sampler = threading.Thread(target=self._sample_loop, name="profiler-sampler", daemon=True)
+        self._sampler.start()
+        _active = self
+        logger.info(f"🔬 已开启性能分析，报告将写入 {self.report_dir}")
+        return self
+
+    def stop(self):
+        global _active
+        _active = None
+        self._cprofile.disable()
+        self._stop_event.set()
+        if self._sampler:
+            self._sampler.join()
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+
+        self._write_cprofile()
+        self._write_stacks()
+        self._write_allocations()
+        self._write_neo4j_profile()
+        self._write_summary(peak)
+        logger.info(f"🔬 性能分析报告已写入 {self.report_dir}")
+
+    # ---------------- 分析段 ----------------
+    def enter_section(self, name):
+        with self._lock:
+            if self._depth == 0:
+                self._snapshot = tracemalloc.take_snapshot()
+                self._cprofile.enable()
+            self._depth += 1
+        self._section_starts.append((name, time.perf_counter()))
+
+    def exit_section(self, name):
+        _, started = self._section_starts.pop()
+        stats = self._section_stats[name]
+        stats["calls"] += 1
+        stats["seconds"] += time.perf_counter() - started
+
+        with self._lock:
+            self._depth -= 1
+            if self._depth == 0:
+                self._cprofile.disable()
+            if self._depth == 0 and self._snapshot is not None:
+                diff = tracemalloc.take_snapshot().compare_to(self._snapshot, 'lineno')
+                for stat in diff:
+                    key = str(stat.traceback[0]) if stat.traceback else "<unknown>"
+                    self._alloc_diff[key] += stat.size_diff
+                    self._alloc_count[key] += stat.count_diff
+                self._snapshot = None
+
+    # ---------------- 采样 ----------------
+    def _sample_loop(self):
+        own_id = threading.get_ident()
+        names = {}
+        while not self._stop_event.wait(self.sample_interval):
+            if self._depth == 0:
+                continue
+            for thread in threading.enumerate():
+                names[thread.ident] = thread.name
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_id:
+                    continue
+                stack = []
+                while frame is not None:
+                    stack.append(_frame_label(frame))
+                    frame = frame.f_back
+                stack.append(names.get(thread_id, str(thread_id)))
+                self._stacks[";".join(reversed(stack))] += 1
+            self._samples += 1
+
+    # ---------------- Neo4j ----------------
+    def record_query(self, cypher, summary, seconds):
+        """记录一次带 PROFILE 执行的 Cypher"""
+        plan = getattr(summary, "profile", None) or {}
+        key = " ".join(cypher.split())
+        entry = self._queries.setdefault(key, {"calls": 0, "db_hits": 0, "rows": 0, "seconds": 0.0, "max_db_hits": -1, "plan": []})
+        db_hits = _sum_db_hits(plan)
+        entry["calls"] += 1
+        entry["db_hits"] += db_hits
+        entry["rows"] += plan.get("rows", 0)
+        entry["seconds"] += seconds
+        # 保留 db hits 最多的一次执行计划
+        if db_hits > entry["max_db_hits"]:
+            entry["max_db_hits"] = db_hits
+            entry["plan"] = _format_plan(plan)
+
+    # ---------------- 报告 ----------------
+    def _path(self, filename):
+        return os.path.join(self.report_dir, filename)
+
+    def _write_cprofile(self):
+        self._cprofile.dump_stats(self._path("cprofile.pstats"))
+        buffer = io.StringIO()
+        stats = pstats.Stats(self._cprofile, stream=buffer)
+        stats.sort_stats("cumulative").print_stats(settings.PROFILE_TOP_N)
+        with open(self._path("cprofile.txt"), 'w', encoding='utf-8') as f:
+            f.write(buffer.getvalue())
+
+    def _write_stacks(self):
+        with open(self._path("stacks.collapsed"), 'w', encoding='utf-8') as f:
+            for stack, count in self._stacks.most_common():
+                f.write(f"{stack} {count}\n")
+
+    def _write_allocations(self):
+        lines = [f"{'净增字节':>14} {'净增对象':>10}  位置"]
+        for location, size in self._alloc_diff.most_common(settings.PROFILE_TOP_N):
+            lines.append(f"{size:>14,} {self._alloc_count[location]:>10,}  {location}")
+        with open(self._path("allocations.txt"), 'w', encoding='utf-8') as f:
+            f.write("\n".join(lines) + "\n")
+
+    def _write_neo4j_profile(self):
+        queries = sorted(self._queries.items(), key=lambda item: item[1]["db_hits"], reverse=True)
+        with open(self._path("neo4j_profile.json"), 'w', encoding='utf-8') as f:
+            json.dump([{"cypher": cypher, **entry} for cypher, entry in queries], f, ensure_ascii=False, indent=2)
+
+        lines = []
+        for cypher, entry in queries:
+            lines.append(f"db hits: {entry['db_hits']:,}  调用: {entry['calls']}  行数: {entry['rows']:,}  耗时: {entry['seconds']*1000:.1f} ms")
+            lines.append(f"  {cypher[:300]}")
+            lines += [f"    {line}" for line in entry["plan"]]
+            lines.append("")
+        with open(self._path("neo4j_profile.txt"), 'w', encoding='utf-8') as f:
+            f.write("\n".join(lines))
+
+    def _write_summary(self, peak_bytes):
+        lines = ["分析段:"]
+        for name, stats in sorted(self._section_stats.items(), key=lambda item: item[1]["seconds"], reverse=True):
+            lines.append(f"  {name:<28} 调用 {stats['calls']:>5} 次  共 {stats['seconds']:.3f} s")
+        lines.append(f"栈采样: {self._samples} 次 (间隔 {self.sample_interval*1000:.0f} ms)")
+        lines.append(f"tracemalloc 峰值: {peak_bytes / 1024 / 1024:.1f} MB")
+        lines.append(f"Neo4j 查询: {len(self._queries)} 种，共 {sum(e['db_hits'] for e in self._queries.values()):,} db hits")
+        lines.append("")
+        lines.append("文件: cprofile.pstats / cprofile.txt (函数统计), stacks.collapsed (火焰图),")
+        lines.append("      allocations.txt (内存分配), neo4j_profile.json / neo4j_profile.txt (Cypher 执行计划)")
+        with open(self._path("summary.txt"), 'w', encoding='utf-8') as f:
+            f.write("\n".join(lines) + "\n")
+        logger.info("🔬 性能分析摘要:\n" + "\n".join(lines))
@@ -1,44 +1,80 @@
 import logging
 import json
-from openai import OpenAI
+import time
 from config import settings
+from core.llm_client import get_openai_client
 from core.neo4j_manager import Neo4jManager
-from core.embedding import get_embedding
+from core.embedding import get_embedding, as_driver_list, reduce_embedding
+from core.concept_linker import ConceptLinker
+from core.profiler import profiled
 
 logger = logging.getLogger(__name__)
 
 class GraphRAGQuery:
     def __init__(self):
-        self.neo4j = Neo4jManager()
-        self.llm_client = OpenAI(api_key=settings.API_KEY, base_url=settings.BASE_URL)
+        # 查询只读数据库，不需要初始化 schema，也跳过额外的连通性检查以加快启动
+        # 检索都走 run_read 托管读事务：瞬时错误自动重试，集群 (neo4j:// URI) 下分发到只读成员
+        self.neo4j = Neo4jManager(verify_connectivity=False)
+        # 概念名自动机在第一次查询时才构建
+        self._linker = None
+
+    @property
+    def llm_client(self):
+        """首次调用 LLM 时才创建客户端"""
+        return get_openai_client()
         
-    def query(self, user_query, top_k=5):
+    @profiled("GraphRAGQuery.query")
+    def query(self, user_query, top_k=5, mode="auto", predicates=None):
         """
         执行完整的 RAG 检索与生成流程
         :param user_query: 用户问题
         :param top_k: 检索召回的 chunk 数量
+        :param mode: local 检索文本块; global 检索预先生成的社区摘要;
+                     auto 在没有点名具体概念、且问题像是概括性问题时使用 global
+        :param predicates: 只使用这些谓词关联的实体和关系 (fixed 模式下为原始谓词，dynamic 模式下为关系类型名)
         """
         if not user_query:
             return "❌ 问题不能为空"
 
         logger.info(f"🔎 收到查询: {user_query}")
 
-        # 1. 问题向量化
-        query_embedding = get_embedding(user_query)
+        # 1. 概念链接：在问题中直接匹配已知的概念名 (纯内存操作，不依赖 Embedding 服务)
+        linked_concepts = self._link_concepts(user_query)
+
+        # 2. 问题向量化：使用当前生效的 embedding 版本的模型 (迁移期间仍是旧模型，补全后自动切换)
+        version = self.neo4j.get_active_embedding_version()
+        query_embedding = get_embedding(user_query, model=version["model"], dimensions=version["dim"])
         if not query_embedding:
-            return "❌ 无法生成问题向量，请检查 Embedding 服务。", ""
+            if not linked_concepts:
+                return "❌ 无法生成问题向量，请检查 Embedding 服务。", ""
+            logger.warning("⚠️ 无法生成问题向量，只使用概念链接的检索结果")
+
+        # 全局问题：直接用少量社区摘要作为上下文，而不是拼接大量原始文本块
+        if query_embedding and self._is_global_question(user_query, linked_concepts, mode):
+            communities = self._community_search(query_embedding, version)
+            if communities:
+                logger.info(f"🏘️ 按全局问题处理，使用 {len(communities)} 个社区摘要")
+                context_str = self._format_community_context(communities)
+                return self._generate_answer(user_query, context_str)
+            logger.info("ℹ️ 没有可用的社区摘要，改用文本块检索")
 
-        # 2. 混合检索（向量相似度 + 图谱关联）
-        # 这一步通过 Neo4j 的向量索引查找相似 Chunk，并顺带把相关的 Concept 名字也查出来
-        retrieved_info = self._vector_graph_search(query_embedding, top_k)
+        # 3. 混合检索（概念链接 + 向量相似度 + 图谱关联）
+        # 问题中点名的概念直接从图谱取文本块和关系；再通过向量索引查找相似 Chunk，并顺带把相关的 Concept 名字也查出来
+        retrieved_info, relations = [], []
+        if linked_concepts:
+            retrieved_info += self._concept_graph_search(linked_concepts, version, query_embedding, predicates)
+            relations = self._concept_relations(linked_concepts, predicates=predicates)
+        if query_embedding:
+            retrieved_info += self._vector_graph_search(query_embedding, version, top_k, predicates)
+        retrieved_info = self._dedupe_records(retrieved_info)
         
-        if not retrieved_info:
+        if not retrieved_info and not relations:
             return "⚠️ 未在知识库中找到相关信息。", ""
 
-        # 3. 构建上下文
-        context_str = self._format_context(retrieved_info)
+        # 4. 构建上下文
+        context_str = self._format_context(retrieved_info, relations)
         
-        # 4. 生成回答
+        # 5. 生成回答
         answer, full_prompt = self._generate_answer(user_query, context_str)
         
         return answer, full_prompt
@@ -63,7 +99,137 @@ class GraphRAGQuery:
         except Exception as e:
             return f"❌ 直接生成失败: {e}", full_prompt
 
-    def _vector_graph_search(self, query_vec, top_k):
+    @staticmethod
+    def _is_global_question(user_query, linked_concepts, mode):
+        if mode != "auto":
+            return mode == "global"
+        if not settings.COMMUNITY_ENABLED or linked_concepts:
+            return False
+        return any(keyword in user_query for keyword in settings.COMMUNITY_GLOBAL_KEYWORDS)
+
+    def _community_search(self, query_vec, version):
+        """在社区摘要的向量索引上检索与问题最相关的社区"""
+        if not self.neo4j.driver:
+            return []
+
+        cypher = """
+        CALL db.index.vector.queryNodes($index_name, $top_k, $query_vec)
+        YIELD node AS community, score
+        RETURN community.summary AS summary,
+               [(community)-[:HAS_MEMBER]->(c:Concept) | c.name][0..10] AS members,
+               score
+        """
+        try:
+            return self.neo4j.run_read(
+                cypher,
+                index_name=version["community_index"],
+                top_k=settings.COMMUNITY_TOP_K,
+                query_vec=as_driver_list(query_vec)
+            )
+        except Exception as e:
+            logger.error(f"❌ 社区摘要检索失败: {e}")
+            return []
+
+    def _format_community_context(self, communities):
+        """将社区摘要格式化为 LLM 可读的文本"""
+        context_parts = []
+        for i, rec in enumerate(communities):
+            members = "、".join(rec['members'] or [])
+            context_parts.append(f"[主题摘要 {i+1}] (相关度: {rec['score']:.3f}, 涉及概念: {members})\n内容: {rec['summary']}")
+        return "\n\n".join(context_parts)
+
+    def _link_concepts(self, user_query):
+        """用概念名自动机找出问题中提到的概念 (规范名列表)"""
+        if not settings.CONCEPT_LINKING_ENABLED or not self.neo4j.driver:
+            return []
+        if self._linker is None:
+            self._linker = ConceptLinker(self.neo4j)
+        self._linker.refresh()
+
+        start = time.perf_counter()
+        concepts = self._linker.find(user_query)
+        elapsed_us = (time.perf_counter() - start) * 1e6
+        if concepts:
+            logger.info(f"🔤 问题中命中概念: {', '.join(concepts)} ({elapsed_us:.0f} µs)")
+        return concepts
+
+    def _concept_graph_search(self, concepts, version, query_vec=None, predicates=None):
+        """
+        从命中的概念出发取其文本块：每个概念最多取 chunks_per_concept 个，
+        有问题向量时按与问题的相似度排序，否则 score 为空
+        """
+        if not self.neo4j.driver:
+            return []
+
+        cypher = """
+        MATCH (s:Concept) WHERE s.name IN $names
+        CALL {
+            WITH s
+            MATCH (s)-[m]->(chunk:Chunk)
+            WHERE $predicates IS NULL OR coalesce(m.predicate, type(m)) IN $predicates
+            WITH chunk,
+                 CASE WHEN $query_vec IS NULL THEN null
+                      ELSE vector.similarity.cosine(chunk[$embedding_property], $query_vec) END AS score
+            ORDER BY score DESC
+            LIMIT $per_concept
+            RETURN chunk, score
+        }
+        RETURN chunk.content AS content, s.name AS entity, score
+        """
+        try:
+            return self.neo4j.run_read(
+                cypher,
+                names=concepts,
+                predicates=predicates,
+                query_vec=as_driver_list(query_vec) if query_vec else None,
+                embedding_property=version["property"],
+                per_concept=settings.CONCEPT_LINKING_CHUNKS_PER_CONCEPT
+            )
+        except Exception as e:
+            logger.error(f"❌ 概念检索失败: {e}")
+            return []
+
+    def _concept_relations(self, concepts, limit=20, predicates=None):
+        """命中概念的一跳关系 (概念之间的三元组)，作为图谱上下文"""
+        if not self.neo4j.driver:
+            return []
+
+        # 出边和入边分开匹配再 UNION：每一支都从 Concept.name 唯一约束的索引查找起点，
+        # 写成 h.name IN $names OR t.name IN $names 会退化为扫描全部关系
+        cypher = """
+        CALL {
+            MATCH (c:Concept) WHERE c.name IN $names
+            MATCH (c)-[r]->(t:Concept)
+            WHERE $predicates IS NULL OR coalesce(r.predicate, type(r)) IN $predicates
+            RETURN c.name AS head, coalesce(r.predicate, type(r)) AS relation, t.name AS tail
+            UNION
+            MATCH (c:Concept) WHERE c.name IN $names
+            MATCH (h:Concept)-[r]->(c)
+            WHERE $predicates IS NULL OR coalesce(r.predicate, type(r)) IN $predicates
+            RETURN h.name AS head, coalesce(r.predicate, type(r)) AS relation, c.name AS tail
+        }
+        RETURN head, relation, tail
+        LIMIT $limit
+        """
+        try:
+            return self.neo4j.run_read(cypher, names=concepts, predicates=predicates, limit=limit)
+        except Exception as e:
+            logger.error(f"❌ 读取概念关系失败: {e}")
+            return []
+
+    @staticmethod
+    def _dedupe_records(records):
+        """同一文本块可能同时被概念链接和向量检索召回，只保留第一次出现的"""
+        seen = set()
+        unique = []
+        for rec in records:
+            if rec['content'] in seen:
+                continue
+            seen.add(rec['content'])
+            unique.append(rec)
+        return unique
+
+    def _vector_graph_search(self, query_vec, version, top_k, predicates=None):
         """
         核心检索逻辑：
         1. 使用 vector index 找到最相似的 chunk
@@ -73,29 +239,55 @@ class GraphRAGQuery:
         if not self.neo4j.driver:
             return []
 
-        # 注意：这里假设之前创建的索引名为 chunk_embedding_index
         # 使用 Neo4j 5.x 的 db.index.vector.queryNodes 过程
+        # reduced / 量化模式下，先在低精度索引上召回 top_k * multiplier 个候选，
+        # 再用全精度向量重新计算余弦相似度排序 (vector.similarity.cosine 需要 Neo4j 5.18+)
+        # 索引名和向量属性取自生效的 embedding 版本
+        rescore = settings.VECTOR_STORAGE_MODE == "reduced" or settings.VECTOR_QUANTIZATION
+        if settings.VECTOR_STORAGE_MODE == "reduced":
+            index_name = version["reduced_index"]
+            index_vec = reduce_embedding(query_vec, settings.VECTOR_REDUCED_DIM)
+        else:
+            index_name = version["index"]
+            index_vec = query_vec
+        candidates = top_k * settings.VECTOR_CANDIDATE_MULTIPLIER if rescore else top_k
+
+        rescore_clause = """
+        WITH chunk, vector.similarity.cosine(chunk[$embedding_property], $query_vec) AS score
+        ORDER BY score DESC
+        LIMIT $top_k
+        """ if rescore else ""
+
         cypher = f"""
-        CALL db.index.vector.queryNodes('chunk_embedding_index', $top_k, $query_vec) 
+        CALL db.index.vector.queryNodes($index_name, $candidates, $index_vec) 
         YIELD node AS chunk, score
-        
+        {rescore_clause}
         // 找到该 chunk 关联的实体（主语）
-        OPTIONAL MATCH (s:Concept)-[:HAS_MENTION|DESCRIBES|RELATED_TO]->(chunk)
+        // fixed 模式下谓词在 MENTIONS.predicate 上，dynamic 模式下就是关系类型
+        OPTIONAL MATCH (s:Concept)-[m]->(chunk)
+        WHERE $predicates IS NULL OR coalesce(m.predicate, type(m)) IN $predicates
         
         RETURN chunk.content AS content, 
                s.name AS entity, 
                score
         """
         try:
-            with self.neo4j.driver.session() as session:
-                result = session.run(cypher, top_k=top_k, query_vec=query_vec)
-                return [record.data() for record in result]
+            return self.neo4j.run_read(
+                cypher,
+                index_name=index_name,
+                candidates=candidates,
+                index_vec=as_driver_list(index_vec),
+                query_vec=as_driver_list(query_vec),
+                embedding_property=version["property"],
+                top_k=top_k,
+                predicates=predicates
+            )
         except Exception as e:
             logger.error(f"❌ 检索失败: {e}")
             return []
 
-    def _format_context(self, records):
-        """将检索到的记录格式化为 LLM 可读的文本"""
+    def _format_context(self, records, relations=None):
+        """将检索到的记录 (以及概念关系) 格式化为 LLM 可读的文本"""
         context_parts = []
         for i, rec in enumerate(records):
             content = rec['content']
@@ -105,8 +297,13 @@ class GraphRAGQuery:
             # 格式示例:
             # [参考片段 1] (相关度: 0.92, 关联实体: 闭包)
             # 内容: 闭包是一个函数...
-            part = f"[参考片段 {i+1}] (相关度: {score:.3f}, 关联实体: {entity})\n内容: {content}"
+            relevance = f"{score:.3f}" if score is not None else "概念命中"
+            part = f"[参考片段 {i+1}] (相关度: {relevance}, 关联实体: {entity})\n内容: {content}"
             context_parts.append(part)
+
+        if relations:
+            lines = [f"- {rel['head']} -[{rel['relation']}]-> {rel['tail']}" for rel in relations]
+            context_parts.append("[图谱关系]\n" + "\n".join(lines))
         
         return "\n\n".join(context_parts)
 
@@ -0,0 +1,110 @@
+import logging
+import time
+from config import settings
+from core.embedding import get_embeddings_batch
+from core.neo4j_manager import Neo4jManager, EMBEDDING_LABELS, EMBEDDING_BUILDING, EMBEDDING_RETIRED
+from core.profiler import profiled
+
+logger = logging.getLogger(__name__)
+
+
+def _format_coverage(coverage):
+    return "，".join(f"{label} {done}/{total}" for label, (done, total) in coverage.items())
+
+
+def _is_complete(coverage):
+    return all(done >= total for done, total in coverage.values())
+
+
+def _fill_label(neo4j_mgr, version, label):
+    """
+    为一种节点补全某个版本的向量：分批读取缺少该版本向量的节点，用库中保存的文本 (块内容 / 社区摘要) 重新计算
+    按 requests_per_minute 限速；连续失败 max_consecutive_failures 次后停止，下次运行从断点继续
+    :return: 是否正常结束 (没有因为连续失败而中止)
+    """
+    interval = 60.0 / max(settings.EMBEDDING_MIGRATION_REQUESTS_PER_MINUTE, 1)
+    failed_ids = set()
+    failures = 0
+    filled = 0
+
+    while True:
+        started = time.monotonic()
+        rows = neo4j_mgr.get_missing_embeddings(version, label, settings.EMBEDDING_MIGRATION_BATCH_SIZE, failed_ids)
+        if not rows:
+            break
+
+        vectors = get_embeddings_batch([row["text"] or "" for row in rows], model=version["model"], dimensions=version["dim"])
+        done = []
+        for row, vector in zip(rows, vectors):
+            # 维度不符说明服务端忽略了 dimensions 参数，写进索引也检索不到
+            if vector and len(vector) == version["dim"]:
+                done.append((row["id"], vector))
+            else:
+                failed_ids.add(row["id"])
+
+        if done:
+            neo4j_mgr.set_embeddings(version, label, done)
+            filled += len(done)
+            failures = 0
+            logger.info(f"🔁 [{version['id']}] {label} 已补全 {filled} 个 (本批 {len(done)}/{len(rows)})")
+        else:
+            failures += 1
+            if failures >= settings.EMBEDDING_MIGRATION_MAX_FAILURES:
+                logger.error(f"❌ [{version['id']}] 连续 {failures} 批 Embedding 失败，暂停补全，下次运行从断点继续")
+                return False
+            # 失败时退避：等待时间逐批翻倍
+            time.sleep(interval * 2 ** failures)
+            continue
+
+        time.sleep(max(0.0, interval - (time.monotonic() - started)))
+
+    if failed_ids:
+        logger.warning(f"⚠️ [{version['id']}] {label} 有 {len(failed_ids)} 个节点本轮未能生成向量，下次运行时重试")
+    return True
+
+
+@profiled("run_reembedding")
+def run_reembedding(neo4j_mgr=None, drop_retired=False):
+    """
+    embedding 模型/维度迁移的后台补全任务 (python main.py --reembed)：
+    1. ensure_schema 登记当前配置的版本 (building) 并创建它的向量索引
+    2. 分批、限速地为已有的 Chunk 和 Community 计算新版本的向量 (文本取自库中，不重新调用 LLM 提取)
+    3. 覆盖全部节点后把新版本切换为生效版本，查询端在 refresh_interval 秒内切换到新索引；旧版本退役
+    补全期间查询继续使用旧索引，入库流程会同时写入新旧两个版本，因此任务可以与 watch 模式、查询并行运行
+    :param drop_retired: 切换完成后删除已退役版本的向量索引和向量属性，释放空间
+    """
+    neo4j_mgr = neo4j_mgr or Neo4jManager()
+    if not neo4j_mgr.driver:
+        logger.error("❌ 无法连接到 Neo4j，补全任务终止。")
+        return
+
+    neo4j_mgr.ensure_schema()
+    versions = neo4j_mgr.get_embedding_versions(max_age=0)
+    building = [version for version in versions if version["status"] == EMBEDDING_BUILDING]
+    if not building:
+        logger.info(f"✅ 当前配置的 embedding 版本 ({neo4j_mgr.get_active_embedding_version()['id']}) 已经生效，没有需要补全的版本")
+
+    switched = False
+    for version in building:
+        logger.info(f"🔁 开始补全 embedding 版本 {version['id']}: {_format_coverage(neo4j_mgr.get_embedding_coverage(version))}")
+        if not all(_fill_label(neo4j_mgr, version, label) for label in EMBEDDING_LABELS):
+            return
+
+        coverage = neo4j_mgr.get_embedding_coverage(version)
+        if not _is_complete(coverage):
+            logger.warning(f"⚠️ [{version['id']}] 尚未完全覆盖 ({_format_coverage(coverage)})，查询继续使用旧版本，可稍后重新运行")
+            return
+
+        neo4j_mgr.activate_embedding_version(version["id"])
+        switched = True
+        logger.info(f"🔀 embedding 版本 {version['id']} 已覆盖全部数据 ({_format_coverage(coverage)})，已切换为生效版本")
+
+    if drop_retired:
+        if switched:
+            # 查询进程最多缓存 refresh_interval 秒的生效版本，等它们都切到新索引后再删除旧索引
+            logger.info(f"⏳ 等待 {settings.EMBEDDING_VERSION_REFRESH_INTERVAL} 秒，让查询进程切换到新版本后再删除旧索引...")
+            time.sleep(settings.EMBEDDING_VERSION_REFRESH_INTERVAL)
+        for version in neo4j_mgr.get_embedding_versions(max_age=0):
+            if version["status"] == EMBEDDING_RETIRED:
+                neo4j_mgr.drop_embedding_version(version)
+                logger.info(f"🗑️ 已删除退役的 embedding 版本 {version['id']} 的向量索引和向量属性")
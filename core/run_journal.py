@@ -0,0 +1,128 @@
+import json
+import logging
+import os
+import time
+from config import settings
+
+logger = logging.getLogger(__name__)
+
+# 单篇笔记在流水线中依次经历的阶段
+STAGES = ("loaded", "extracted", "embedded", "written")
+
+
+def _runs_dir():
+    runs_dir = os.path.join(settings.ROOT_DIR, 'storage', 'runs')
+    if not os.path.exists(runs_dir):
+        os.makedirs(runs_dir)
+    return runs_dir
+
+
+class RunJournal:
+    """
+    持久化的运行日志：记录每篇笔记 (source_id + 内容 hash) 当前到达的阶段
+    采用 JSONL 追加写入，每次阶段变化写一行；启动时回放得到每篇笔记的最新状态并压缩文件
+    流水线中断后重新运行时，已经 written 的笔记直接跳过，其余笔记从缓存继续
+    """
+
+    def __init__(self, path=None):
+        self.path = path or os.path.join(_runs_dir(), 'journal.jsonl')
+        self._state = {}
+        self._load()
+        self._compact()
+        self._file = open(self.path, 'a', encoding='utf-8')
+
+    def _load(self):
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    # 进程崩溃时最后一行可能只写了一半，直接忽略
+                    continue
+                if entry.get("stage") is None:
+                    self._state.pop(entry.get("source_id"), None)
+                else:
+                    self._state[entry["source_id"]] = entry
+
+    def _compact(self):
+        """只保留每篇笔记的最新状态，避免日志无限增长"""
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            for entry in self._state.values():
+                f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+        os.replace(tmp_path, self.path)
+
+    def stage_of(self, source_id, content_hash):
+        """返回该版本笔记已到达的阶段，内容变化 (hash 不同) 视为从头开始"""
+        entry = self._state.get(source_id)
+        if not entry or entry.get("hash") != content_hash:
+            return None
+        return entry["stage"]
+
+    def is_done(self, source_id, content_hash):
+        return self.stage_of(source_id, content_hash) == "written"
+
+    def record(self, source_id, content_hash, stage):
+        """记录阶段变化并立即刷盘"""
+        entry = {"source_id": source_id, "hash": content_hash, "stage": stage, "ts": time.time()}
+        self._state[source_id] = entry
+        self._file.write(json.dumps(entry, ensure_ascii=False) + "\n")
+        self._file.flush()
+
+    def forget(self, source_id):
+        """删除某篇笔记的记录 (例如笔记被删除)"""
+        if self._state.pop(source_id, None) is not None:
+            self._file.write(json.dumps({"source_id": source_id, "stage": None}, ensure_ascii=False) + "\n")
+            self._file.flush()
+
+    def close(self):
+        self._file.close()
+
+
+class DeadLetterQueue:
+    """
+    失败笔记的死信队列：提取、JSON 解析、向量补全或写库失败的笔记记录在这里，
+    可以通过 `python main.py --retry-failed` 重新处理，成功后自动移除
+    """
+
+    def __init__(self, path=None):
+        self.path = path or os.path.join(_runs_dir(), 'dead_letter.json')
+        self._entries = {}
+        if os.path.exists(self.path):
+            try:
+                with open(self.path, 'r', encoding='utf-8') as f:
+                    self._entries = json.load(f)
+            except Exception as e:
+                logger.error(f"❌ 读取死信队列失败: {e}")
+
+    def _save(self):
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self._entries, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, self.path)
+
+    def add(self, source_id, note_obj, stage, error):
+        """记录失败的笔记，重复失败时累加次数"""
+        previous = self._entries.get(source_id, {})
+        self._entries[source_id] = {
+            "filename": note_obj.get("filename"),
+            "filepath": note_obj.get("filepath"),
+            "stage": stage,
+            "error": str(error),
+            "attempts": previous.get("attempts", 0) + 1,
+            "failed_at": time.strftime("%Y-%m-%d %H:%M:%S"),
+        }
+        self._save()
+        logger.warning(f"📮 [{source_id}] 在 {stage} 阶段失败，已加入死信队列: {error}")
+
+    def remove(self, source_id):
+        if self._entries.pop(source_id, None) is not None:
+            self._save()
+
+    def entries(self):
+        return dict(self._entries)
+
+    def __len__(self):
+        return len(self._entries)
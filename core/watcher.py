@@ -0,0 +1,187 @@
+import logging
+import os
+import threading
+import time
+from config import settings
+from core.neo4j_manager import Neo4jManager
+from core.pipeline import run_graph_pipeline, remove_sources, make_source_id
+from utils.file_ops import load_file_content, load_all_markdown_files
+
+logger = logging.getLogger(__name__)
+
+
+def _is_note(path):
+    """只关心数据目录下的 .md 文件，忽略编辑器的隐藏/临时文件"""
+    name = os.path.basename(path)
+    return name.endswith('.md') and not name.startswith(('.', '~'))
+
+
+class NoteWatcher:
+    """
+    watch 模式：常驻进程，跟随数据目录的文件变化增量入库
+    - 优先使用 watchdog (inotify / FSEvents / ReadDirectoryChangesW)，未安装时退化为轮询目录的 mtime
+    - 同一文件连续保存产生的一串事件会被合并 (debounce)，安静 debounce_seconds 秒后才处理
+    - 新增/修改的笔记走 run_graph_pipeline；删除的笔记从图谱、缓存和运行日志中移除
+    """
+
+    def __init__(self, data_dir, prompt_template):
+        self.data_dir = os.path.abspath(data_dir)
+        self.prompt_template = prompt_template
+        self.neo4j = Neo4jManager()
+
+        # 待处理的变化: 路径 -> (是否已删除, 该路径最后一次事件的时间)；由 watchdog 线程写入，主循环读取
+        self._pending = {}
+        self._lock = threading.Lock()
+
+        self._observer = None
+        self._snapshot = {}
+
+    def record(self, path, deleted=False):
+        """登记一次文件变化 (同一路径只保留最后一次的状态)"""
+        if not _is_note(path) or os.path.dirname(os.path.abspath(path)) != self.data_dir:
+            return
+        with self._lock:
+            self._pending[os.path.abspath(path)] = (deleted, time.monotonic())
+
+    def _start_observer(self):
+        """启动 watchdog；不可用时返回 False，改用轮询"""
+        if not settings.WATCH_USE_WATCHDOG:
+            return False
+        try:
+            from watchdog.observers import Observer
+            from watchdog.events import FileSystemEventHandler
+        except ImportError:
+            logger.info("ℹ️ 未安装 watchdog，使用轮询模式监听目录 (pip install watchdog 可获得即时通知)")
+            return False
+
+        watcher = self
+
+        class _Handler(FileSystemEventHandler):
+            def on_created(self, event):
+                if not event.is_directory:
+                    watcher.record(event.src_path)
+
+            def on_modified(self, event):
+                if not event.is_directory:
+                    watcher.record(event.src_path)
+
+            def on_deleted(self, event):
+                if not event.is_directory:
+                    watcher.record(event.src_path, deleted=True)
+
+            def on_moved(self, event):
+                # 重命名 = 删除旧文件 + 新增新文件 (编辑器的"写临时文件再改名"也走这里)
+                if not event.is_directory:
+                    watcher.record(event.src_path, deleted=True)
+                    watcher.record(event.dest_path)
+
+        self._observer = Observer()
+        self._observer.schedule(_Handler(), self.data_dir, recursive=False)
+        self._observer.start()
+        return True
+
+    def _scan(self):
+        """轮询模式：比对目录快照 (mtime + 大小)，把差异登记为变化"""
+        snapshot = {}
+        with os.scandir(self.data_dir) as entries:
+            for entry in entries:
+                if entry.is_file() and _is_note(entry.path):
+                    stat = entry.stat()
+                    snapshot[entry.path] = (stat.st_mtime_ns, stat.st_size)
+
+        for path, signature in snapshot.items():
+            if self._snapshot.get(path) != signature:
+                self.record(path)
+        for path in set(self._snapshot) - set(snapshot):
+            self.record(path, deleted=True)
+        self._snapshot = snapshot
+
+    def _take_ready(self):
+        """
+        按路径分别 debounce：取出已经安静了 debounce_seconds 秒的路径
+        某个文件被持续保存时，只推迟它自己，不会挡住其他文件
+        """
+        now = time.monotonic()
+        with self._lock:
+            ready = {path: deleted for path, (deleted, last_event) in self._pending.items()
+                     if now - last_event >= settings.WATCH_DEBOUNCE_SECONDS}
+            for path in ready:
+                del self._pending[path]
+            return ready
+
+    def sync_once(self):
+        """
+        启动时的一次性同步：处理 watch 进程不在时发生的新增/修改 (运行日志会跳过未变化的笔记)，
+        并移除数据库中已经没有对应文件的来源
+        """
+        notes = load_all_markdown_files(self.data_dir)
+        if notes:
+            run_graph_pipeline(notes, self.prompt_template, neo4j_mgr=self.neo4j)
+
+        present = {make_source_id(note["filename"]) for note in notes}
+        try:
+            orphans = sorted(set(self.neo4j.get_source_hashes()) - present)
+        except Exception as e:
+            logger.error(f"❌ 读取数据库中的来源列表失败，跳过残留数据清理: {e}")
+            return
+        if orphans:
+            logger.info(f"🗑️ 发现 {len(orphans)} 个已删除笔记的残留数据，正在清理...")
+            remove_sources(orphans, neo4j_mgr=self.neo4j)
+
+    def process(self, changes):
+        """处理一批合并后的变化"""
+        notes, deleted = [], []
+        for path, is_deleted in sorted(changes.items()):
+            filename = os.path.basename(path)
+            # 删除事件之后文件可能又被重新创建，以磁盘上的实际状态为准
+            if is_deleted or not os.path.exists(path):
+                deleted.append(make_source_id(filename))
+                continue
+            content = load_file_content(path)
+            if content:
+                notes.append({"filename": filename, "filepath": path, "content": content})
+            else:
+                # 清空的笔记等同于删除
+                deleted.append(make_source_id(filename))
+
+        logger.info(f"👀 检测到变化: {len(notes)} 篇新增/修改，{len(deleted)} 篇删除")
+        if deleted:
+            remove_sources(deleted, neo4j_mgr=self.neo4j)
+        if notes:
+            run_graph_pipeline(notes, self.prompt_template, neo4j_mgr=self.neo4j)
+
+    def run(self):
+        """阻塞运行，直到 Ctrl+C"""
+        if not self.neo4j.driver:
+            logger.error("❌ 无法连接到 Neo4j，watch 模式终止。")
+            return
+
+        self.sync_once()
+
+        polling = not self._start_observer()
+        if polling:
+            self._scan()
+        logger.info(f"👀 正在监听 {self.data_dir} ({'轮询' if polling else 'watchdog'} 模式)，按 Ctrl+C 退出")
+
+        tick = min(settings.WATCH_POLL_INTERVAL, settings.WATCH_DEBOUNCE_SECONDS) if polling else 0.2
+        last_scan = time.monotonic()
+        try:
+            while True:
+                time.sleep(tick)
+                if polling and time.monotonic() - last_scan >= settings.WATCH_POLL_INTERVAL:
+                    self._scan()
+                    last_scan = time.monotonic()
+
+                changes = self._take_ready()
+                if changes:
+                    try:
+                        self.process(changes)
+                    except Exception as e:
+                        logger.error(f"❌ 处理文件变化出错: {e}", exc_info=True)
+        except KeyboardInterrupt:
+            logger.info("👋 停止监听")
+        finally:
+            if self._observer:
+                self._observer.stop()
+                self._observer.join()
+            self.neo4j.close()
@@ -1,3 +1,4 @@
+import argparse
 import logging
 import sys
 import os
@@ -7,14 +8,32 @@ sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 
 from config import settings
 from utils.file_ops import load_file_content, load_all_markdown_files
-from core.pipeline import run_graph_pipeline
+from core.pipeline import run_graph_pipeline, retry_dead_letters
 
 # 初始化日志
 settings.setup_logging()
 logger = logging.getLogger(__name__)
 
+def parse_args():
+    parser = argparse.ArgumentParser(description="构建 GraphRAG 知识图谱")
+    parser.add_argument("--retry-failed", action="store_true", help="只重试死信队列中失败的笔记")
+    parser.add_argument("--no-resume", action="store_true", help="忽略运行日志，重新检查所有笔记")
+    parser.add_argument("--watch", action="store_true", help="常驻监听数据目录，笔记新增/修改/删除后增量入库")
+    parser.add_argument("--rebuild-communities", action="store_true", help="只重新划分社区并重新生成全部社区摘要")
+    parser.add_argument("--reembed", action="store_true", help="换了 embedding 模型/维度后，在后台补全新版本的向量，覆盖全部数据后切换查询")
+    parser.add_argument("--drop-retired-embeddings", action="store_true", help="与 --reembed 一起使用：切换后删除旧版本的向量索引和向量属性")
+    parser.add_argument("--profile", action="store_true", help="开启性能分析 (CPU 采样、内存分配、Neo4j PROFILE)，报告写入 reports/")
+    return parser.parse_args()
+
 if __name__ == "__main__":
+    args = parse_args()
     logger.info("程序启动...")
+
+    if args.profile:
+        import atexit
+        from core.profiler import Profiler
+        # 各分支都以 exit() 结束，用 atexit 保证报告在进程退出前写出
+        atexit.register(Profiler().start().stop)
     
     # 1. 读取 Prompt 模板
     logger.info(f"读取 Prompt: {settings.PROMPT_FILE}")
@@ -23,6 +42,42 @@ if __name__ == "__main__":
         print(f"❌ 错误：无法读取 Prompt 文件: {settings.PROMPT_FILE}")
         exit()
 
+    if args.rebuild_communities:
+        from core.neo4j_manager import Neo4jManager
+        from core.community import refresh_communities
+        try:
+            refresh_communities(Neo4jManager(), force=True)
+        except Exception as e:
+            logger.error(f"重建社区过程中发生错误: {e}", exc_info=True)
+            print(f"❌ 程序运行出错，请查看日志: {e}")
+        exit()
+
+    if args.reembed:
+        from core.reembed import run_reembedding
+        try:
+            run_reembedding(drop_retired=args.drop_retired_embeddings)
+        except Exception as e:
+            logger.error(f"补全向量过程中发生错误: {e}", exc_info=True)
+            print(f"❌ 程序运行出错，请查看日志: {e}")
+        exit()
+
+    if args.retry_failed:
+        try:
+            retry_dead_letters(prompt_content)
+        except Exception as e:
+            logger.error(f"重试过程中发生错误: {e}", exc_info=True)
+            print(f"❌ 程序运行出错，请查看日志: {e}")
+        exit()
+
+    if args.watch:
+        from core.watcher import NoteWatcher
+        try:
+            NoteWatcher(settings.DATA_DIR, prompt_content).run()
+        except Exception as e:
+            logger.error(f"监听过程中发生错误: {e}", exc_info=True)
+            print(f"❌ 程序运行出错，请查看日志: {e}")
+        exit()
+
     # 2. 读取 Data 目录下的所有笔记
     logger.info(f"读取数据目录: {settings.DATA_DIR}")
     notes_list = load_all_markdown_files(settings.DATA_DIR)
@@ -32,7 +87,7 @@ if __name__ == "__main__":
 
     # 3. 开始构建
     try:
-        run_graph_pipeline(notes_list, prompt_content)
+        run_graph_pipeline(notes_list, prompt_content, resume=not args.no_resume)
     except Exception as e:
         logger.error(f"运行过程中发生错误: {e}", exc_info=True)
-        print(f"❌ 程序运行出错，请查看日志: {e}")
\ No newline at end of file
+        print(f"❌ 程序运行出错，请查看日志: {e}")
@@ -0,0 +1,52 @@
+"""
+测量各入口模块的导入耗时 (基于 python -X importtime)
+用法: python measure_startup.py [模块名 ...]
+"""
+import os
+import re
+import subprocess
+import sys
+
+ROOT_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# 默认测量的入口：CLI 与查询进程实际会导入的模块
+DEFAULT_MODULES = ["config.settings", "core.pipeline", "core.query_engine"]
+
+_LINE_PATTERN = re.compile(r"import time:\s+(\d+)\s+\|\s+(\d+)\s+\|(\s*)(\S+)")
+
+def measure(module, top_n=8):
+    """在干净的子进程中导入模块，返回 (总耗时 ms, 最慢的若干模块)"""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=ROOT_DIR, capture_output=True, text=True
+    )
+    if result.returncode != 0:
+        raise RuntimeError(result.stderr.strip().splitlines()[-1])
+
+    entries = []
+    for line in result.stderr.splitlines():
+        match = _LINE_PATTERN.match(line)
+        if match:
+            self_us, cumulative_us, indent, name = match.groups()
+            # 只统计顶层导入 (缩进最浅) 的累计耗时，避免重复计算
+            entries.append((name, int(cumulative_us), len(indent)))
+
+    total_us = sum(cum for _, cum, depth in entries if depth == 1)
+    slowest = sorted(entries, key=lambda e: e[1], reverse=True)[:top_n]
+    return total_us / 1000, [(name, cum / 1000) for name, cum, _ in slowest]
+
+def main():
+    modules = sys.argv[1:] or DEFAULT_MODULES
+    for module in modules:
+        try:
+            total_ms, slowest = measure(module)
+        except RuntimeError as e:
+            print(f"❌ {module}: 导入失败 ({e})")
+            continue
+
+        print(f"⏱️ {module}: {total_ms:.1f} ms")
+        for name, cum_ms in slowest:
+            print(f"    {cum_ms:8.1f} ms  {name}")
+
+if __name__ == "__main__":
+    main()
@@ -1,10 +1,11 @@
 # utils/file_ops.py
 import os
-import yaml
 import logging
 
 def load_yaml_config(filepath):
     """加载 yaml 配置文件"""
+    import yaml  # 只有真正读取配置时才导入
+
     if not os.path.exists(filepath):
         # 尝试使用绝对路径或相对于当前文件的路径
         if not os.path.isabs(filepath):
@@ -16,7 +16,8 @@ def verify_data():
             stats_query = """
             MATCH (c:Chunk)
             RETURN count(c) as total_chunks, 
-                   count(c.embedding) as chunks_with_embedding
+                   count(c.embedding) as chunks_with_embedding,
+                   count(c.id) as chunks_with_id
             """
             stats = session.run(stats_query).single()
             
@@ -44,7 +45,8 @@ def verify_data():
                 f.write("=== Neo4j 数据统计 ===\n")
                 f.write(f"总 Chunk 节点数: {stats['total_chunks']}\n")
                 f.write(f"拥有 embedding 属性的节点数: {stats['chunks_with_embedding']}\n")
-                f.write(f"缺失 embedding 属性的节点数: {stats['total_chunks'] - stats['chunks_with_embedding']}\n\n")
+                f.write(f"缺失 embedding 属性的节点数: {stats['total_chunks'] - stats['chunks_with_embedding']}\n")
+                f.write(f"缺失 id (旧版 CREATE 写入) 的节点数: {stats['total_chunks'] - stats['chunks_with_id']}\n\n")
                 
                 if stats['chunks_with_embedding'] > 0:
                     f.write("=== 成功存入向量的节点示例 ===\n")
@@ -61,6 +63,9 @@ def verify_data():
                     f.write("检测到库中存在冗余的、没有向量的老数据。\n")
                     f.write("原因：之前的运行由于代码未完成，产生了没有向量的节点；由于代码使用 CREATE 语句，重复运行会产生新节点而不会覆盖老节点。\n")
                     f.write("建议：你可以调用 neo4j_mgr.clear_database() 清空后重新运行 main.py，或者手动执行 Cypher: MATCH (c:Chunk) WHERE c.embedding IS NULL DETACH DELETE c\n")
+                if stats['total_chunks'] > stats['chunks_with_id']:
+                    f.write("检测到旧版本写入的、没有 id 的 Chunk 节点。现在 Chunk 按内容 hash (id) MERGE，重复运行不会再产生重复节点。\n")
+                    f.write("建议：执行 Cypher: MATCH (c:Chunk) WHERE c.id IS NULL DETACH DELETE c，然后运行 python main.py --no-resume 重新写入。\n")
 
         print(f"验证完成！详细报告已写入: {output_file}")
             